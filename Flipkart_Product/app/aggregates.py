@@ -0,0 +1,109 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from emotions import LABEL_CATEGORY
+
+AGGREGATES_PATH = os.environ.get('EMOTION_AGGREGATES_PATH', 'emotion_aggregates.sqlite3')
+GRANULARITIES = {'hour': 3600, 'day': 86400}
+
+
+def bucket_start(timestamp, granularity):
+    width = GRANULARITIES[granularity]
+    return int(timestamp // width * width)
+
+
+class EmotionAggregates:
+    # Per-product counts of each label in hourly and daily buckets, bumped as
+    # predictions arrive, so trend and distribution charts read a few rows per
+    # bucket instead of every stored review
+    def __init__(self, path=AGGREGATES_PATH):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS emotion_counts ('
+            'product TEXT, granularity TEXT, bucket INTEGER, label TEXT, count INTEGER, '
+            'PRIMARY KEY (product, granularity, bucket, label))'
+        )
+        self.conn.commit()
+
+    def add(self, product, labels, timestamp=None):
+        counts = Counter(label for label in labels if label is not None)
+        if not counts:
+            return 0
+        timestamp = time.time() if timestamp is None else timestamp
+        rows = [(product, granularity, bucket_start(timestamp, granularity), label, count)
+                for granularity in GRANULARITIES for label, count in counts.items()]
+        with self.lock:
+            self.conn.executemany(
+                'INSERT INTO emotion_counts VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (product, granularity, bucket, label) DO UPDATE SET count = count + excluded.count',
+                rows
+            )
+            self.conn.commit()
+        return sum(counts.values())
+
+    def label_rows(self, product, granularity='hour', since=None):
+        query = 'SELECT bucket, label, count FROM emotion_counts WHERE product = ? AND granularity = ?'
+        params = [product, granularity]
+        if since is not None:
+            query += ' AND bucket >= ?'
+            params.append(bucket_start(since, granularity))
+        with self.lock:
+            return self.conn.execute(query + ' ORDER BY bucket', params).fetchall()
+
+    def trend(self, product, granularity='hour', since=None, by='category', mapping=LABEL_CATEGORY):
+        totals = Counter()
+        for bucket, label, count in self.label_rows(product, granularity, since):
+            totals[bucket, mapping.get(label, 'Neutral') if by == 'category' else label] += count
+        column = 'Emotion Category' if by == 'category' else 'Emotion'
+        return [{'Bucket': datetime.fromtimestamp(bucket, timezone.utc), column: key, 'Count': count}
+                for (bucket, key), count in sorted(totals.items())]
+
+    def distribution(self, product, since=None, by='category', mapping=LABEL_CATEGORY):
+        totals = Counter()
+        for _, label, count in self.label_rows(product, 'day', since):
+            totals[mapping.get(label, 'Neutral') if by == 'category' else label] += count
+        column = 'Emotion Category' if by == 'category' else 'Emotion'
+        return [{column: key, 'Count': count} for key, count in totals.most_common()]
+
+    def total(self, product):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT COALESCE(SUM(count), 0) FROM emotion_counts WHERE product = ? AND granularity = 'day'",
+                (product,)
+            ).fetchone()
+        return row[0]
+
+    def products(self):
+        with self.lock:
+            return [row[0] for row in self.conn.execute('SELECT DISTINCT product FROM emotion_counts ORDER BY product')]
+
+    def rebuild(self, product, store):
+        # Recounts a product from the review store, e.g. for reviews stored
+        # before the aggregates existed
+        table = store.read(product, columns=['label', 'scraped_at'])
+        with self.lock:
+            self.conn.execute('DELETE FROM emotion_counts WHERE product = ?', (product,))
+            self.conn.commit()
+        if table.num_rows == 0:
+            return 0
+        by_time = {}
+        for scraped_at, label in zip(table.column('scraped_at').to_pylist(), table.column('label').to_pylist()):
+            by_time.setdefault(scraped_at.timestamp(), []).append(label)
+        return sum(self.add(product, labels, timestamp) for timestamp, labels in by_time.items())
+
+
+_aggregates = None
+_aggregates_lock = threading.Lock()
+
+
+def get_aggregates():
+    global _aggregates
+    with _aggregates_lock:
+        if _aggregates is None:
+            _aggregates = EmotionAggregates()
+        return _aggregates
@@ -1,9 +1,12 @@
+import os
 import streamlit as st
-import pandas as pd
-from transformers import pipeline
-import plotly.express as px
-import requests
-from bs4 import BeautifulSoup
+# Only light modules are imported up front so the first render is fast;
+# pandas, plotly, pyarrow, aiohttp and the model stack load on first use
+from emotions import EMOTION_LABELS, LABEL_CATEGORY, NEGATIVE_EMOTIONS, POSITIVE_EMOTIONS
+from models import EMOTION_MODEL, MODEL_OFFLINE, SENTIMENT_MODEL, cache_model_id, get_model, model_error, model_status, registry_stats, warm_up_async
+from metrics import get_metrics, profiled, span
+from aggregates import get_aggregates
+from store_paths import stored_products
 
 st.set_page_config(
     page_title="Sentiment Analysis tool",
@@ -15,135 +18,297 @@ st.set_page_config(
 st.title("Real Time Brand Monitoring and Interactive Analysis💕")
 
 detected_emotions_list = []
+detected_predictions = []
 
-emotion = pipeline('sentiment-analysis', model='arpanghoshal/EmoRoBERTa')
+warm_up_async()
 
-def process_csv_input(file):
-    encoding_list = ['utf-8', 'latin-1', 'ISO-8859-1']
-
-    for encoding in encoding_list:
-        try:
-            df = pd.read_csv(file, encoding=encoding)
-            st.success(f"CSV file successfully loaded using encoding: {encoding}")
-            st.table(df)  
-            sentences = df["Comment"].tolist()
-            perform_emotion_analysis(sentences)
-            break  
-        except UnicodeDecodeError:
-            st.warning(f"Failed to decode using encoding: {encoding}")
-            continue 
+def render_model_status():
+    status = model_status('emotion')
+    mode = " (offline snapshot)" if MODEL_OFFLINE else ""
+    if status == 'ready':
+        st.caption(f"🟢 Emotion model ready{mode}")
+    elif status == 'error':
+        st.error(f"Emotion model failed to load: {model_error('emotion')}")
     else:
-        st.error("Unable to decode the CSV file using any of the tried encodings. Please check the file encoding.")
+        st.caption(f"🟡 Emotion model loading in the background{mode}; the first analysis waits for it")
+
+def emotion_classifier():
+    from workers import get_classifier
+    if model_status('emotion') == 'ready':
+        return get_classifier('emotion')
+    with st.spinner("Waiting for the emotion model to finish loading..."):
+        return get_classifier('emotion')
+
+def process_csv_input(file, column="Comment"):
+    from cache import get_cache
+    from ingest import detect_encoding, iter_csv_column
+    from streaming import analyze_chunks
+
+    encoding = detect_encoding(file)
+    st.success(f"CSV file successfully loaded using encoding: {encoding}")
+
+    st.header(f"Detected Emotions Distribution for {file.name}")
+    progress = st.empty()
+    charts = st.empty()
+    table = st.empty()
+    try:
+        updates = analyze_chunks(iter_csv_column(file, column, encoding), emotion_classifier(), cache_model_id(EMOTION_MODEL), get_cache())
+        for update in updates:
+            progress.caption(f"{update['stats']['rows']} rows classified from {update['stats']['chunks']} chunks..." + (f" {dedup_caption(update['stats']['dedup'])}" if update['stats']['dedup'] else ""))
+            render_progress(update, charts, table, file.name)
+    except ValueError as error:
+        st.error(f"Unable to read the '{column}' column from the CSV file: {error}")
 
 def perform_emotion_analysis(sentences):
+    import pandas as pd
+    from cache import get_cache
+    from inference import classify_cached, summarize_throughput
+
     detected_emotions_list.clear() 
-    for sentence in sentences:
-        emotion_labels = emotion(sentence)
-        detected_emotion = emotion_labels[0]['label']
+    dedup_stats = {}
+    predictions, batch_stats = classify_cached(emotion_classifier(), cache_model_id(EMOTION_MODEL), sentences, get_cache(), stats=dedup_stats)
+    detected_predictions[:] = predictions
+    for sentence, emotion_labels in zip(sentences, predictions):
+        detected_emotion = emotion_labels['label']
         detected_emotions_list.append((sentence, detected_emotion))
 
     st.write("Emotion Analysis Results:")
-    result_df = pd.DataFrame(detected_emotions_list, columns=["Comment", "Detected_Emotion"])
-    st.table(result_df)
+    with span('dataframe'):
+        result_df = pd.DataFrame(detected_emotions_list, columns=["Comment", "Detected_Emotion"])
+    with span('render'):
+        st.table(result_df)
+    cache_stats = get_cache().stats()
+    st.caption(f"Prediction cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['entries']} entries")
+    if dedup_stats:
+        st.caption(dedup_caption(dedup_stats))
+    if batch_stats:
+        st.caption(summarize_throughput(batch_stats))
+        with st.expander("Per-batch throughput"):
+            st.table(pd.DataFrame(batch_stats))
+
+def dedup_caption(dedup_stats):
+    return (f"Deduplication: {dedup_stats['classified']} of {dedup_stats['texts']} reviews sent to the model "
+            f"({dedup_stats['exact_duplicates']} exact, {dedup_stats['near_duplicates']} near duplicates, "
+            f"{dedup_stats['dedup_ratio']:.0%} skipped)")
 
 def plot_emotions(filename, product_name):
+    import pandas as pd
+    from emotions import EmotionTally
+    from scores import ScoreMatrix
+
     st.header(f"Detected Emotions Distribution for {filename}")
 
     if detected_emotions_list:
-        df_emotions = pd.DataFrame(detected_emotions_list, columns=['Comment', 'Detected_Emotion'])
-
-        emotion_counts = df_emotions['Detected_Emotion'].value_counts().reset_index()
-        emotion_counts.columns = ['Emotion', 'Count']
+        # Categories come from the model's own top label; the float16 score
+        # matrix is only used for the top 3 listing
+        tally = EmotionTally()
+        tally.update(prediction['label'] for prediction in detected_predictions)
+        render_category_charts(pd.DataFrame(tally.category_counts()), filename)
+        scores = ScoreMatrix.from_predictions(detected_predictions)
+        top_indices, top_scores = scores.top_k(3)
+        with st.expander("Top 3 emotions per text"):
+            st.dataframe(pd.DataFrame({
+                "Comment": [comment for comment, _ in detected_emotions_list],
+                "Top Emotions": [', '.join(f"{EMOTION_LABELS[i]} ({score:.2f})" for i, score in zip(indices, row_scores))
+                                 for indices, row_scores in zip(top_indices, top_scores)]
+            }), hide_index=True)
+    else:
+        st.info("No emotions detected yet.")
 
-        positive_emotions = ['admiration', 'amusement', 'approval', 'caring', 'desire', 'excitement', 'gratitude', 'joy', 'love', 'optimism', 'pride', 'realization', 'relief']
-        negative_emotions = ['anger', 'annoyance', 'disappointment', 'disapproval', 'disgust', 'embarrassment', 'fear', 'grief', 'nervousness', 'remorse', 'sadness']
-        df_emotions['Emotion Category'] = df_emotions['Detected_Emotion'].apply(lambda x: 'Positive' if x in positive_emotions else ('Negative' if x in negative_emotions else 'Neutral'))
+def render_category_charts(emotion_category_counts, filename):
+    import plotly.express as px
 
-        emotion_category_counts = df_emotions['Emotion Category'].value_counts().reset_index()
-        emotion_category_counts.columns = ['Emotion Category', 'Count']
+    fig_bar = px.bar(emotion_category_counts, x='Emotion Category', y='Count', labels={'Emotion Category': 'Emotion Category', 'Count': 'Count'}, color='Emotion Category')
+    st.plotly_chart(fig_bar)
 
-        fig_bar = px.bar(emotion_category_counts, x='Emotion Category', y='Count', labels={'Emotion Category': 'Emotion Category', 'Count': 'Count'}, color='Emotion Category')
-        st.plotly_chart(fig_bar)
-
-        fig_pie = px.pie(emotion_category_counts, values='Count', names='Emotion Category', title=f'Detected Emotions Distribution for {filename}', color='Emotion Category')
-        st.plotly_chart(fig_pie)
-    else:
-        st.info("No emotions detected yet.")
+    fig_pie = px.pie(emotion_category_counts, values='Count', names='Emotion Category', title=f'Detected Emotions Distribution for {filename}', color='Emotion Category')
+    st.plotly_chart(fig_pie)
 
 def predict_sentiment(text):
-    sentiment_classifier = pipeline('sentiment-analysis')
-    result = sentiment_classifier(text)
-    return result[0]['label']
-
-def scrape_reviews_and_save_to_csv(product_name, url):
-    headers = {
-        'User-Agent': 'Your_User_Agent_Here',
-        'Accept-Language': 'en-us,en;q=0.5'
-    }
-
-    customer_names = []
-    review_title = []
-    ratings = []
-    comments = []
-
-    for i in range(1, 44):
-        page = requests.get(url.format(i), headers=headers)
-        soup = BeautifulSoup(page.content, 'html.parser')
-
-        names = soup.find_all('p', class_='_2sc7ZR')
-        for name in names:
-            customer_names.append(name.get_text(strip=True))
-
-        titles = soup.find_all('p', class_='_2-N8zT')
-        for title in titles:
-            review_title.append(title.get_text(strip=True))
-
-        ratings_all = soup.find_all('div', class_='col _2wzgFH K0kLPL')
-        for rating in ratings_all:
-            ratings.append(rating.div.text.strip())
-
-        comments_all = soup.find_all('div', class_='t-ZTKy')
-        for comment in comments_all:
-            comment_text = comment.div.div.get_text(strip=True)
-            comments.append(comment_text)
-
-    min_length = min(len(customer_names), len(review_title), len(ratings), len(comments))
-    customer_names = customer_names[:min_length]
-    review_title = review_title[:min_length]
-    ratings = ratings[:min_length]
-    comments = comments[:min_length]
-
-    data = {
-        'Customer Name': customer_names,
-        'Review Title': review_title,
-        'Rating': ratings,
-        'Comment': comments
-    }
-
-    df = pd.DataFrame(data)
+    from cache import get_cache
+    from inference import classify_cached
+
+    predictions, _ = classify_cached(get_model('sentiment'), cache_model_id(SENTIMENT_MODEL), [text], get_cache())
+    return predictions[0]['label'].lower()
+
+def render_progress(update, charts, table, filename):
+    import pandas as pd
+
+    with span('dataframe'):
+        counts_df = pd.DataFrame(update['tally'].category_counts())
+        recent_df = pd.DataFrame(list(update['recent']), columns=["Comment", "Detected_Emotion"])
+    with span('render'):
+        with charts.container():
+            render_category_charts(counts_df, filename)
+        table.dataframe(recent_df)
+
+def stream_scrape_and_analyze(product_name, url, incremental=False):
+    import pandas as pd
+    from cache import get_cache
+    from incremental import MAX_PAGES, get_state, most_recent_first
+    from review_parser import COLUMNS
+    from store import ReviewStore
+    from streaming import stream_analysis
+
+    # Seen reviews are tracked in every mode: an incremental scrape skips
+    # them, a full one still re-reads them but stores and counts them once
+    history = get_state()
+    state = history if incremental else None
+    if incremental:
+        url = most_recent_first(url)
     filename = f'{product_name}_reviews.csv'
-    df.to_csv(filename, index=False)
+    if not incremental and os.path.exists(filename):
+        os.remove(filename)
+
+    st.header(f"Detected Emotions Distribution for {product_name}")
+    progress = st.empty()
+    charts = st.empty()
+    table = st.empty()
+
+    store_writer = ReviewStore().writer(product_name)
+    aggregates = get_aggregates()
+    # Buffered rows are only marked seen and counted once the store has them;
+    # until then this run remembers them itself
+    buffered = set()
+
+    def commit(fingerprints, labels, pages):
+        def callback():
+            aggregates.add(product_name, labels)
+            history.mark_seen(product_name, fingerprints, pages)
+            buffered.difference_update(fingerprints)
+        return callback
+
+    updates = stream_analysis(
+        (url.format(i) for i in range(1, MAX_PAGES + 1)),
+        emotion_classifier(), cache_model_id(EMOTION_MODEL), get_cache(), product_name, state
+    )
+    # A Streamlit rerun or a failed batch still flushes what was classified
+    try:
+        for update in updates:
+            fresh = [i for i in history.unseen(product_name, update['fingerprints']) if update['fingerprints'][i] not in buffered]
+            fingerprints = [update['fingerprints'][i] for i in fresh]
+            buffered.update(fingerprints)
+            if update['reviews']:
+                with span('csv'):
+                    pd.DataFrame(update['reviews'], columns=COLUMNS).to_csv(filename, mode='a', index=False, header=not os.path.exists(filename))
+            store_writer.add(
+                [update['reviews'][i] for i in fresh], [update['predictions'][i] for i in fresh], fingerprints,
+                committed=commit(fingerprints, [update['predictions'][i]['label'] for i in fresh], update['stats']['pages'])
+            )
+
+            scrape_stats = update['stats']
+            tally = update['tally']
+            progress.caption(f"{scrape_stats['pages']} pages fetched, {tally.total} reviews classified" + (f" (stopped: {scrape_stats['stop']})" if update['done'] else "..."))
+            if tally.total:
+                render_progress(update, charts, table, product_name)
+            elif update['done']:
+                charts.info("No new reviews found.")
+    finally:
+        store_writer.close()
     return filename
 
+def plot_history(product_name, granularity='day', mapping=LABEL_CATEGORY, rule='top', threshold=None):
+    import pandas as pd
+    import plotly.express as px
+    from store import ReviewStore
+
+    aggregates = get_aggregates()
+    if aggregates.total(product_name) == 0:
+        # Reviews stored before the aggregates existed are counted once
+        aggregates.rebuild(product_name, ReviewStore())
+    total = aggregates.total(product_name)
+    if total == 0:
+        st.info("No stored reviews for this product yet.")
+        return
+    st.caption(f"{total} stored reviews")
+
+    # Categorizing by top emotion counts the stored labels in the rolling
+    # aggregates under any mapping; the mass rule and the threshold chart
+    # are recomputed from the stored score vectors without touching the
+    # model, which are only read when one of them is asked for
+    scores = None
+    if rule != 'top' or threshold is not None:
+        scores = ReviewStore().read_scores(product_name)
+        unscored = len(scores) - int(scores.valid().sum())
+        if unscored:
+            st.caption(f"{unscored} reviews stored before full scores were kept are left out")
+    if rule == 'top':
+        render_category_charts(pd.DataFrame(aggregates.distribution(product_name, mapping=mapping)), product_name)
+    else:
+        render_category_charts(pd.DataFrame(scores.category_counts(mapping, rule=rule)), product_name)
+
+    label_counts = scores.label_counts(threshold) if threshold is not None else []
+    if label_counts:
+        fig_labels = px.bar(pd.DataFrame(label_counts), x='Emotion', y='Count', title=f'Reviews with each emotion scoring at least {threshold:.2f}')
+        st.plotly_chart(fig_labels)
+
+    trend = pd.DataFrame(aggregates.trend(product_name, granularity, mapping=mapping))
+    fig_trend = px.line(trend, x='Bucket', y='Count', color='Emotion Category', markers=True, title=f'Emotion Categories per {granularity.title()} for {product_name}')
+    st.plotly_chart(fig_trend)
+
+def render_diagnostics():
+    import pandas as pd
+
+    metrics = get_metrics()
+    snapshot = metrics.snapshot()
+    st.sidebar.header("Diagnostics")
+    st.sidebar.caption(f"Collected over the last {snapshot['seconds']:.0f}s")
+    st.sidebar.dataframe(pd.DataFrame(registry_stats()), hide_index=True)
+    stage_rows = metrics.stage_rows()
+    if stage_rows:
+        st.sidebar.dataframe(pd.DataFrame(stage_rows), hide_index=True)
+    if snapshot['counters']:
+        st.sidebar.dataframe(pd.DataFrame(list(snapshot['counters'].items()), columns=["Counter", "Value"]), hide_index=True)
+    st.sidebar.download_button("Download JSON", metrics.to_json(), file_name="metrics.json", mime="application/json")
+    st.sidebar.download_button("Download Prometheus", metrics.to_prometheus(), file_name="metrics.prom", mime="text/plain")
+    if st.sidebar.button("Reset metrics"):
+        metrics.reset()
+
 def main():
+    render_model_status()
+    show_diagnostics = st.sidebar.checkbox("Show diagnostics")
+    profile_runs = st.sidebar.checkbox("Profile the next run (cProfile)")
+
     st.header("Scrape Reviews and Save to CSV")
     product_name = st.text_input("Enter Product Name:")
     url = st.text_input("Enter URL for Scraping (Flipkart URL)", value='https://www.flipkart.com/motorola-g84-5g-viva-magneta-256-gb/product-reviews/itmed938e33ffdf5?pid=MOBGQFX672GDDQAQ&lid=LSTMOBGQFX672GDDQAQSSIAM2&marketplace=FLIPKART&page={}')
 
+    incremental = st.checkbox("Only fetch new reviews since the last scrape", value=True)
+
     if st.button("Scrape Reviews"):
         if product_name and url:
             st.info("Scraping reviews and saving to CSV...")
-            filename = scrape_reviews_and_save_to_csv(product_name, url)
+            with profiled('scrape', enabled=profile_runs or None) as profile_path:
+                filename = stream_scrape_and_analyze(product_name, url, incremental)
+            get_metrics().export()
             st.success(f"Reviews scraped and saved to {filename} successfully!")
-            plot_emotions(filename, product_name)  
+            if profile_path:
+                st.caption(f"Profile written to {profile_path}")
         else:
             st.warning("Please enter both product name and URL.")
 
+    products = stored_products()
+    if products:
+        st.header("Review History")
+        history_product = st.selectbox("Stored product:", products)
+        granularity = st.radio("Trend granularity:", ["day", "hour"], horizontal=True)
+        with st.expander("Emotion category rules"):
+            positive = st.multiselect("Positive emotions:", EMOTION_LABELS, default=POSITIVE_EMOTIONS)
+            negative = st.multiselect("Negative emotions:", [label for label in EMOTION_LABELS if label not in positive], default=[label for label in NEGATIVE_EMOTIONS if label not in positive])
+            rule = st.radio("Categorize each review by:", ["top", "mass"], format_func=lambda value: "its top emotion" if value == 'top' else "total score per category", horizontal=True)
+            threshold = st.slider("Multi-label score threshold:", 0.05, 0.95, 0.3, 0.05) if st.checkbox("Chart every emotion above a score threshold") else None
+        mapping = {label: 'Positive' if label in positive else ('Negative' if label in negative else 'Neutral') for label in EMOTION_LABELS}
+        if st.button("Show History"):
+            plot_history(history_product, granularity, mapping, rule, threshold)
+
     uploaded_file = st.file_uploader("Upload CSV", type=["csv"])
     if uploaded_file is not None:
         if st.button("Process CSV Input"):
-            process_csv_input(uploaded_file)
-            plot_emotions(uploaded_file.name, uploaded_file.name)  
+            with profiled('csv', enabled=profile_runs or None) as profile_path:
+                process_csv_input(uploaded_file)
+            get_metrics().export()
+            if profile_path:
+                st.caption(f"Profile written to {profile_path}")
 
     st.header("Text Input for Emotion Analysis")
     text_input = st.text_area("Type or paste your text here:", height=200)
@@ -172,3 +337,9 @@ def main():
     else:
         st.warning("Please enter a review text.")
 
+    if show_diagnostics:
+        render_diagnostics()
+
+if __name__ == "__main__":
+    main()
+
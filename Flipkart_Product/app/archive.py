@@ -0,0 +1,396 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from email.utils import parsedate_to_datetime
+
+import zstandard
+
+from metrics import incr
+from review_parser import COLUMNS, parse_page
+
+ARCHIVE_PATH = os.environ.get('PAGE_ARCHIVE_PATH', 'page_archive')
+ARCHIVE_ENABLED = os.environ.get('PAGE_ARCHIVE', '1') == '1'
+SEGMENT_BYTES = int(os.environ.get('PAGE_ARCHIVE_SEGMENT_BYTES', 256 * 1024 * 1024))
+ZSTD_LEVEL = int(os.environ.get('PAGE_ARCHIVE_ZSTD_LEVEL', 3))
+# Pages without explicit freshness may be reused for 10% of the time since
+# their Last-Modified, capped here; 0 means they are always revalidated
+HEURISTIC_MAX_AGE = float(os.environ.get('PAGE_ARCHIVE_HEURISTIC_MAX_AGE', 0))
+# Re-parsed CSVs go here rather than next to the live {product}_reviews.csv files
+REPARSE_DIR = os.environ.get('PAGE_ARCHIVE_REPARSE_DIR', 'reparsed')
+
+ENTRY_FIELDS = ['id', 'url', 'product', 'fetched_at', 'status', 'segment', 'position', 'length', 'size', 'sha1',
+                'not_modified', 'date', 'age', 'cache_control', 'expires', 'etag', 'last_modified', 'content_type']
+
+_SEGMENT = re.compile(r'segment-(\d+)\.zst$')
+
+
+def http_time(value):
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def cache_directives(value):
+    directives = {}
+    for part in (value or '').lower().split(','):
+        name, _, argument = part.strip().partition('=')
+        if name:
+            directives[name] = argument.strip('"')
+    return directives
+
+
+def freshness_lifetime(entry):
+    # RFC 9111 4.2.1: max-age, then Expires, then the Last-Modified heuristic
+    directives = cache_directives(entry['cache_control'])
+    if 'no-store' in directives or 'no-cache' in directives:
+        return 0.0
+    for name in ('s-maxage', 'max-age'):
+        if directives.get(name, '').isdigit():
+            return float(directives[name])
+    date = http_time(entry['date']) or entry['fetched_at']
+    expires = http_time(entry['expires'])
+    if entry['expires']:
+        # An unparseable Expires means "already expired"
+        return max(0.0, expires - date) if expires is not None else 0.0
+    last_modified = http_time(entry['last_modified'])
+    if last_modified is not None and HEURISTIC_MAX_AGE > 0:
+        return min(HEURISTIC_MAX_AGE, max(0.0, date - last_modified) * 0.1)
+    return 0.0
+
+
+def current_age(entry, now=None):
+    # RFC 9111 4.2.3, taking the fetch time as both request and response time
+    now = time.time() if now is None else now
+    date = http_time(entry['date'])
+    apparent = max(0.0, entry['fetched_at'] - date) if date is not None else 0.0
+    return max(apparent, float(entry['age'] or 0)) + max(0.0, now - entry['fetched_at'])
+
+
+def is_fresh(entry, now=None):
+    return entry['status'] == 200 and freshness_lifetime(entry) > current_age(entry, now)
+
+
+def validators(entry):
+    # Conditional request headers, so an unchanged page comes back as a 304
+    headers = {}
+    if entry['etag']:
+        headers['If-None-Match'] = entry['etag']
+    if entry['last_modified']:
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+
+class PageArchive:
+    # Raw responses appended to zstd-compressed segment files, one frame per
+    # page so any page can be read back by (segment, position, length). A
+    # concatenation of frames is itself valid zstd, so `zstd -dc segment-*.zst`
+    # also works. Segments are only ever appended to; the SQLite index maps URL
+    # and fetch time to a frame, and an unchanged page (same hash, or a 304)
+    # only gets a new index row pointing at the frame already on disk
+    def __init__(self, root=ARCHIVE_PATH, segment_bytes=SEGMENT_BYTES, level=ZSTD_LEVEL):
+        self.root = root
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(root, 'index.sqlite3'), check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            'id INTEGER PRIMARY KEY, url TEXT, product TEXT, fetched_at REAL, status INTEGER, segment INTEGER, '
+            'position INTEGER, length INTEGER, size INTEGER, sha1 TEXT, not_modified INTEGER, date TEXT, age TEXT, '
+            'cache_control TEXT, expires TEXT, etag TEXT, last_modified TEXT, content_type TEXT)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS pages_url ON pages (url, fetched_at)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS pages_product ON pages (product, fetched_at)')
+        self.conn.commit()
+        self.compressor = zstandard.ZstdCompressor(level=level, write_checksum=True)
+        self.segment = max(self.segments(), default=0)
+        self.fd = None
+
+    def segments(self):
+        return sorted(int(match.group(1)) for match in map(_SEGMENT.match, os.listdir(self.root)) if match)
+
+    def segment_path(self, segment):
+        return os.path.join(self.root, f'segment-{segment:06d}.zst')
+
+    def _append(self, body):
+        # O_APPEND writes land atomically at the end of the file, and the
+        # descriptor is left just past them, so the frame's position is right
+        # even when another process appends to the same segment
+        frame = self.compressor.compress(body)
+        if self.fd is not None and os.fstat(self.fd).st_size + len(frame) > self.segment_bytes:
+            os.close(self.fd)
+            self.fd = None
+            self.segment += 1
+        if self.fd is None:
+            path = self.segment_path(self.segment)
+            if not self.segment or (os.path.exists(path) and os.path.getsize(path) + len(frame) > self.segment_bytes):
+                self.segment += 1
+            self.fd = os.open(self.segment_path(self.segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        os.write(self.fd, frame)
+        return self.segment, os.lseek(self.fd, 0, os.SEEK_CUR) - len(frame), len(frame)
+
+    def _insert(self, values):
+        columns = ENTRY_FIELDS[1:]
+        cursor = self.conn.execute(
+            f"INSERT INTO pages ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [values.get(column) for column in columns]
+        )
+        self.conn.commit()
+        return self._select('WHERE id = ?', (cursor.lastrowid,), lock=False)[0]
+
+    def put(self, url, body, headers=None, status=200, product=None, fetched_at=None):
+        headers = {name.lower(): value for name, value in (headers or {}).items()}
+        sha1 = hashlib.sha1(body).hexdigest()
+        with self.lock:
+            previous = self.latest(url, lock=False)
+            if previous is not None and previous['sha1'] == sha1:
+                location = previous['segment'], previous['position'], previous['length']
+            else:
+                location = self._append(body)
+                incr('archive_bytes', location[2])
+            entry = self._insert({
+                'url': url, 'product': product, 'fetched_at': time.time() if fetched_at is None else fetched_at,
+                'status': status, 'segment': location[0], 'position': location[1], 'length': location[2],
+                'size': len(body), 'sha1': sha1, 'not_modified': 0, 'date': headers.get('date'),
+                'age': headers.get('age'), 'cache_control': headers.get('cache-control'),
+                'expires': headers.get('expires'), 'etag': headers.get('etag'),
+                'last_modified': headers.get('last-modified'), 'content_type': headers.get('content-type')
+            })
+        incr('archived_pages')
+        return entry
+
+    def refresh(self, entry, headers=None, product=None):
+        # A 304 revalidated the archived copy: record the fetch with the new
+        # freshness headers against the frame that is already stored
+        headers = {name.lower(): value for name, value in (headers or {}).items()}
+        values = dict(entry, fetched_at=time.time(), not_modified=1, age=headers.get('age'))
+        values['product'] = product or entry['product']
+        for field in ('date', 'cache_control', 'expires', 'etag', 'last_modified'):
+            values[field] = headers.get(field.replace('_', '-'), entry[field])
+        with self.lock:
+            return self._insert(values)
+
+    def latest(self, url, lock=True):
+        rows = self._select('WHERE url = ? ORDER BY fetched_at DESC, id DESC LIMIT 1', (url,), lock)
+        return rows[0] if rows else None
+
+    def history(self, url):
+        return self._select('WHERE url = ? ORDER BY fetched_at, id', (url,))
+
+    def _select(self, clause, params, lock=True):
+        query = f"SELECT {', '.join(ENTRY_FIELDS)} FROM pages {clause}"
+        if lock:
+            with self.lock:
+                rows = self.conn.execute(query, params).fetchall()
+        else:
+            rows = self.conn.execute(query, params).fetchall()
+        return [dict(zip(ENTRY_FIELDS, row)) for row in rows]
+
+    def read(self, entry):
+        with open(self.segment_path(entry['segment']), 'rb') as f:
+            f.seek(entry['position'])
+            return zstandard.ZstdDecompressor().decompress(f.read(entry['length']))
+
+    def entries(self, product=None, since=None, until=None, latest=True):
+        # With latest=True, only the newest fetch of each URL in the window
+        conditions, params = ['status = 200'], []
+        if product is not None:
+            conditions.append('product = ?')
+            params.append(product)
+        if since is not None:
+            conditions.append('fetched_at >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('fetched_at < ?')
+            params.append(until)
+        where = ' AND '.join(conditions)
+        if latest:
+            where = f'id IN (SELECT MAX(id) FROM pages WHERE {where} GROUP BY url)'
+        return self._select(f'WHERE {where} ORDER BY segment, position', params)
+
+    def iter_pages(self, entries):
+        # Frames are read in on-disk order with one open file per segment, so
+        # a bulk replay streams each segment once at disk speed
+        decompressor = zstandard.ZstdDecompressor()
+        segment, f = None, None
+        try:
+            for entry in sorted(entries, key=lambda entry: (entry['segment'], entry['position'])):
+                if entry['segment'] != segment:
+                    if f is not None:
+                        f.close()
+                    segment = entry['segment']
+                    f = open(self.segment_path(segment), 'rb')
+                f.seek(entry['position'])
+                yield entry, decompressor.decompress(f.read(entry['length']))
+        finally:
+            if f is not None:
+                f.close()
+
+    def stats(self):
+        with self.lock:
+            fetches, urls, products, raw = self.conn.execute(
+                'SELECT COUNT(*), COUNT(DISTINCT url), COUNT(DISTINCT product), COALESCE(SUM(size), 0) FROM pages'
+            ).fetchone()
+            pages, stored, unique = self.conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(length), 0), COALESCE(SUM(size), 0) '
+                'FROM (SELECT DISTINCT segment, position, length, size FROM pages)'
+            ).fetchone()
+        segments = self.segments()
+        return {
+            'fetches': fetches, 'urls': urls, 'products': products, 'stored_pages': pages, 'segments': len(segments),
+            'fetched_bytes': raw, 'raw_bytes': unique, 'stored_bytes': stored,
+            'segment_bytes': sum(os.path.getsize(self.segment_path(segment)) for segment in segments),
+            'compression_ratio': round(unique / stored, 2) if stored else None
+        }
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+            self.conn.close()
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive():
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            _archive = PageArchive()
+        return _archive
+
+
+def replay(archive, entries, workers=1, batch=256):
+    # Parses archived pages without touching the network, yielding
+    # (entry, reviews) in on-disk order; workers > 1 parses in processes
+    pages = archive.iter_pages(entries)
+    if workers <= 1:
+        for entry, content in pages:
+            yield entry, parse_page(content)
+        return
+    with ProcessPoolExecutor(workers) as executor:
+        while True:
+            chunk = [page for _, page in zip(range(batch), pages)]
+            if not chunk:
+                return
+            parsed = executor.map(parse_page, [content for _, content in chunk], chunksize=max(1, batch // workers))
+            yield from zip([entry for entry, _ in chunk], parsed)
+
+
+def reparse(archive, product=None, since=None, until=None, latest=False, workers=1, csv_dir=REPARSE_DIR,
+            overwrite=False):
+    # Rebuilds {product}_reviews.csv from the archive with the current
+    # selectors. Every fetch is replayed by default, since a review that has
+    # moved on to a page that was not fetched again only exists in older
+    # fetches. A 304 or an unchanged re-fetch points at the frame it matched,
+    # so each stored frame is parsed once however many fetches share it. A
+    # review seen on several pages or fetches is written once
+    import csv
+    from incremental import review_fingerprint
+
+    fetches = archive.entries(product, since, until, latest)
+    frames = {}
+    for entry in fetches:
+        frames.setdefault((entry['segment'], entry['position']), entry)
+    entries = list(frames.values())
+    existing = sorted({os.path.join(csv_dir, f"{entry['product'] or 'unknown'}_reviews.csv") for entry in entries})
+    existing = [path for path in existing if os.path.exists(path)]
+    if existing and not overwrite:
+        raise FileExistsError(f"{', '.join(existing)} already exist; pass overwrite=True (--overwrite) to replace them")
+    os.makedirs(csv_dir, exist_ok=True)
+
+    stats = {
+        'fetches': len(fetches), 'pages': 0, 'empty_pages': 0, 'reviews': 0, 'duplicates': 0, 'raw_bytes': 0,
+        'products': {}
+    }
+    start = time.perf_counter()
+    files, writers, seen = {}, {}, {}
+    try:
+        for entry, reviews in replay(archive, entries, workers):
+            name = entry['product'] or 'unknown'
+            stats['pages'] += 1
+            stats['raw_bytes'] += entry['size']
+            if not reviews:
+                stats['empty_pages'] += 1
+                continue
+            if name not in writers:
+                files[name] = open(os.path.join(csv_dir, f'{name}_reviews.csv'), 'w', newline='', encoding='utf-8')
+                writers[name] = csv.writer(files[name])
+                writers[name].writerow(COLUMNS)
+                seen[name] = set()
+            fresh = []
+            for review in reviews:
+                fingerprint = review_fingerprint(review)
+                if fingerprint not in seen[name]:
+                    seen[name].add(fingerprint)
+                    fresh.append(review)
+            writers[name].writerows(['' if value is None else value for value in review] for review in fresh)
+            stats['duplicates'] += len(reviews) - len(fresh)
+            stats['reviews'] += len(fresh)
+            stats['products'][name] = stats['products'].get(name, 0) + len(fresh)
+    finally:
+        for f in files.values():
+            f.close()
+    seconds = time.perf_counter() - start
+    stats['seconds'] = round(seconds, 3)
+    stats['pages_per_sec'] = round(stats['pages'] / seconds, 1) if seconds > 0 else None
+    stats['raw_mb_per_sec'] = round(stats['raw_bytes'] / seconds / 1e6, 1) if seconds > 0 else None
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect the raw page archive and re-parse it without the network")
+    parser.add_argument('--root', default=ARCHIVE_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('stats', help="page, byte and compression totals")
+    show = commands.add_parser('cat', help="write the archived body of a URL to stdout")
+    show.add_argument('url')
+    show.add_argument('--at', type=float, help="the newest fetch at or before this Unix time")
+    rebuild = commands.add_parser('reparse', help="rebuild {product}_reviews.csv files from archived pages")
+    rebuild.add_argument('--product')
+    rebuild.add_argument('--since', type=float, help="Unix time")
+    rebuild.add_argument('--until', type=float, help="Unix time")
+    rebuild.add_argument('--latest-only', action='store_true', help="only the newest fetch of each URL, not every fetch")
+    rebuild.add_argument('--workers', type=int, default=1)
+    rebuild.add_argument('--csv-dir', default=REPARSE_DIR)
+    rebuild.add_argument('--overwrite', action='store_true', help="replace CSV files that already exist in --csv-dir")
+    args = parser.parse_args(argv)
+
+    archive = PageArchive(args.root)
+    if args.command == 'stats':
+        print(json.dumps(archive.stats(), indent=2))
+    elif args.command == 'cat':
+        entries = [entry for entry in archive.history(args.url) if args.at is None or entry['fetched_at'] <= args.at]
+        if not entries:
+            print(f"{args.url} is not in the archive", file=sys.stderr)
+            return 1
+        sys.stdout.buffer.write(archive.read(entries[-1]))
+    else:
+        try:
+            stats = reparse(
+                archive, args.product, args.since, args.until, args.latest_only, args.workers, args.csv_dir, args.overwrite
+            )
+        except FileExistsError as error:
+            print(error, file=sys.stderr)
+            return 1
+        print(json.dumps(stats, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
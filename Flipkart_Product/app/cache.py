@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+CACHE_PATH = os.environ.get('PREDICTION_CACHE_PATH', 'predictions.sqlite3')
+MAX_ENTRIES = int(os.environ.get('PREDICTION_CACHE_MAX_ENTRIES', 500000))
+
+# Keep well below SQLite's default limit on bound parameters
+_CHUNK = 500
+
+
+def normalize_text(text):
+    text = unicodedata.normalize('NFKC', str(text)).casefold()
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def cache_key(model_id, text):
+    return hashlib.sha256(f"{model_id}\x00{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+
+class PredictionCache:
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS predictions ('
+            'key TEXT PRIMARY KEY, model_id TEXT, label TEXT, scores TEXT, last_used REAL)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS predictions_last_used ON predictions (last_used)')
+        self.conn.commit()
+
+    def get_many(self, keys):
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        with self.lock:
+            for i in range(0, len(keys), _CHUNK):
+                chunk = keys[i:i + _CHUNK]
+                marks = ','.join('?' * len(chunk))
+                rows = self.conn.execute(
+                    f'SELECT key, label, scores FROM predictions WHERE key IN ({marks})', chunk
+                ).fetchall()
+                for key, label, scores in rows:
+                    scores = json.loads(scores)
+                    found[key] = {'label': label, 'score': scores.get(label), 'scores': scores}
+                if rows:
+                    self.conn.execute(
+                        f"UPDATE predictions SET last_used = ? WHERE key IN ({','.join('?' * len(rows))})",
+                        [time.time()] + [row[0] for row in rows]
+                    )
+            self.conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, model_id, items):
+        now = time.time()
+        rows = [(key, model_id, prediction['label'], json.dumps(prediction['scores']), now)
+                for key, prediction in items]
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?)', rows)
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        count = self.conn.execute('SELECT COUNT(*) FROM predictions').fetchone()[0]
+        if count > self.max_entries:
+            self.conn.execute(
+                'DELETE FROM predictions WHERE key IN '
+                '(SELECT key FROM predictions ORDER BY last_used LIMIT ?)',
+                (count - self.max_entries,)
+            )
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute('SELECT COUNT(*) FROM predictions').fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries
+        }
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute('DELETE FROM predictions')
+            self.conn.commit()
+            self.hits = self.misses = 0
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = PredictionCache()
+        return _cache
@@ -0,0 +1,200 @@
+import argparse
+import json
+import os
+import sys
+import time
+from contextlib import closing
+from urllib.parse import urlsplit
+
+from aggregates import get_aggregates
+from cache import get_cache
+from incremental import MAX_PAGES, ScrapeState, iter_page_reviews, most_recent_first, new_scrape_stats, review_fingerprint
+from inference import DEFAULT_BATCH_SIZE, classify_cached
+from ingest import iter_csv_reviews
+from metrics import get_metrics, profiled
+from models import EMOTION_MODEL, cache_model_id
+from review_parser import COLUMNS
+from store import STORE_PATH, ReviewStore
+from workers import get_classifier
+
+
+def stage(rows, seconds):
+    return {
+        'rows': rows,
+        'seconds': round(seconds, 4),
+        'rows_per_sec': round(rows / seconds, 1) if seconds > 0 else None
+    }
+
+
+def parse_input(value):
+    # Inputs are "name=source" or a bare URL/CSV path
+    name, sep, source = value.partition('=')
+    if not sep or '://' in name:
+        name, source = None, value
+    if source.lower().endswith('.csv') and '://' not in source:
+        return name or os.path.splitext(os.path.basename(source))[0], 'csv', source
+    if '{}' not in source:
+        source += ('&' if '?' in source else '?') + 'page={}'
+    return name or urlsplit(source).path.strip('/').split('/')[0], 'url', source
+
+
+class Run:
+    def __init__(self, args):
+        self.args = args
+        self.store = ReviewStore(args.store)
+        # Without the model nothing is looked up or stored, so the cache
+        # file is not even created
+        self.cache = None if args.no_cache or args.no_classify else get_cache()
+        self.state = ScrapeState() if args.incremental else None
+        # Seen reviews are tracked in every mode so that re-running a
+        # product does not add its reviews to the store and counts twice
+        self.history = self.state or ScrapeState()
+        self.classifier = None
+        self.dedup_stats = {}
+        # Products whose CSV this run has already started; later chunks append
+        self.csv_written = set()
+
+    def classify(self, reviews):
+        if self.args.no_classify or not reviews:
+            return None, 0.0
+        if self.classifier is None:
+            self.classifier = get_classifier('emotion')
+        start = time.perf_counter()
+        predictions, _ = classify_cached(
+            self.classifier, cache_model_id(EMOTION_MODEL), [review.comment for review in reviews], self.cache, self.args.batch_size,
+            stats=self.dedup_stats
+        )
+        return predictions, time.perf_counter() - start
+
+    def save(self, product, reviews, predictions, fingerprints, pages=0):
+        start = time.perf_counter()
+        # Unclassified reviews stay out of the store and are not marked seen,
+        # so a later run with the model still classifies and stores them
+        if not self.args.no_classify:
+            fresh = self.history.unseen(product, fingerprints)
+            writer = self.store.writer(product)
+            writer.add(
+                [reviews[i] for i in fresh], [predictions[i] for i in fresh] if predictions else None,
+                [fingerprints[i] for i in fresh]
+            )
+            writer.close()
+            if predictions:
+                get_aggregates().add(product, [predictions[i]['label'] for i in fresh])
+            self.history.mark_seen(product, [fingerprints[i] for i in fresh], pages)
+        if self.args.csv_dir:
+            import pandas as pd
+            filename = os.path.join(self.args.csv_dir, f'{product}_reviews.csv')
+            append = self.args.incremental or product in self.csv_written
+            pd.DataFrame(reviews, columns=COLUMNS).to_csv(
+                filename, mode='a' if append else 'w', index=False,
+                header=not (append and os.path.exists(filename))
+            )
+            self.csv_written.add(product)
+        return time.perf_counter() - start
+
+    def run_url(self, product, url):
+        if self.state is not None:
+            url = most_recent_first(url)
+        scrape_stats = new_scrape_stats()
+        reviews, fingerprints = [], []
+        page_urls = (url.format(i) for i in range(1, self.args.max_pages + 1))
+        for page_reviews, page_fingerprints in iter_page_reviews(page_urls, product, self.state, stats=scrape_stats):
+            reviews.extend(page_reviews)
+            fingerprints.extend(page_fingerprints)
+
+        predictions, classify_seconds = self.classify(reviews)
+        store_seconds = self.save(product, reviews, predictions, fingerprints, scrape_stats['pages'])
+        return {
+            'pages': scrape_stats['pages'],
+            'failed_pages': scrape_stats['failed_pages'],
+            'stop': scrape_stats['stop'],
+            'stages': {
+                'fetch': stage(scrape_stats['pages'], scrape_stats['fetch_seconds']),
+                'parse': stage(scrape_stats['reviews'], scrape_stats['parse_seconds']),
+                'classify': stage(len(reviews) if predictions else 0, classify_seconds),
+                'store': stage(0 if self.args.no_classify else len(reviews), store_seconds)
+            }
+        }
+
+    def run_csv(self, product, path):
+        totals = {'read': [0, 0.0], 'classify': [0, 0.0], 'store': [0, 0.0]}
+        # The reader generator is closed while the file is still open, not
+        # later by the garbage collector
+        with open(path, 'rb') as f, closing(iter_csv_reviews(f)) as chunks:
+            while True:
+                start = time.perf_counter()
+                reviews = next(chunks, None)
+                totals['read'][1] += time.perf_counter() - start
+                if reviews is None:
+                    break
+                totals['read'][0] += len(reviews)
+
+                predictions, seconds = self.classify(reviews)
+                totals['classify'][0] += len(reviews) if predictions else 0
+                totals['classify'][1] += seconds
+
+                fingerprints = [review_fingerprint(review) for review in reviews]
+                totals['store'][1] += self.save(product, reviews, predictions, fingerprints)
+                totals['store'][0] += 0 if self.args.no_classify else len(reviews)
+        return {'stages': {name: stage(rows, seconds) for name, (rows, seconds) in totals.items()}}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Scrape, classify and store product reviews without the Streamlit UI. "
+                    "Inputs are Flipkart review URLs or CSV files, optionally prefixed with 'name='."
+    )
+    parser.add_argument('inputs', nargs='+')
+    parser.add_argument('--max-pages', type=int, default=MAX_PAGES)
+    parser.add_argument('--incremental', action='store_true', help="only keep reviews not seen in earlier runs")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--no-classify', action='store_true', help="skip the model; reviews only go to --csv-dir, not the store")
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--store', default=STORE_PATH)
+    parser.add_argument('--csv-dir', help="also write {product}_reviews.csv files here")
+    parser.add_argument('--stats-file', help="write the JSON stats here as well as to stdout")
+    parser.add_argument('--metrics-file', help="export stage timings and counters (.prom for Prometheus text, else JSON)")
+    parser.add_argument('--profile', metavar='DIR', help="run under cProfile and dump the stats into DIR")
+    args = parser.parse_args(argv)
+    if args.csv_dir:
+        os.makedirs(args.csv_dir, exist_ok=True)
+
+    started = time.perf_counter()
+    run = Run(args)
+    results = []
+    with profiled('cli', args.profile, enabled=bool(args.profile) or None) as profile_path:
+        for value in args.inputs:
+            product, kind, source = parse_input(value)
+            result = {'input': value, 'product': product, 'kind': kind}
+            try:
+                result.update(run.run_csv(product, source) if kind == 'csv' else run.run_url(product, source))
+                result['ok'] = True
+            except Exception as error:
+                result['ok'] = False
+                result['error'] = f'{type(error).__name__}: {error}'
+            results.append(result)
+
+    stats = {
+        'ok': all(result['ok'] for result in results),
+        'seconds': round(time.perf_counter() - started, 3),
+        'inputs': results
+    }
+    if run.cache is not None:
+        stats['cache'] = run.cache.stats()
+    if run.dedup_stats:
+        stats['dedup'] = run.dedup_stats
+    stats['metrics'] = get_metrics().snapshot()
+    if profile_path:
+        stats['profile'] = profile_path
+    get_metrics().export(args.metrics_file)
+
+    output = json.dumps(stats, indent=2)
+    print(output)
+    if args.stats_file:
+        with open(args.stats_file, 'w') as f:
+            f.write(output)
+    return 0 if stats['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
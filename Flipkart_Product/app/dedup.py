@@ -0,0 +1,106 @@
+import os
+import re
+import unicodedata
+
+import numpy as np
+
+from cache import normalize_text
+
+THRESHOLD = float(os.environ.get('DEDUP_THRESHOLD', 0.8))
+# Near-duplicate matching is opt-in: a one-word edit such as "not very good"
+# keeps trigram similarity above 0.9 while flipping the meaning
+NEAR_DUPLICATES = os.environ.get('DEDUP_NEAR', '0') == '1'
+SHINGLE_SIZE = 3
+NUM_PERM = 64
+BANDS = 8
+_PRIME = (1 << 31) - 1
+
+# Near-duplicate matching drops punctuation but keeps emoji and other
+# symbols: "Nice!!" and "nice." look alike, "Nice 😍" and "Nice 😡" do not.
+# Exact matching keeps punctuation since "Good?" and "Good!" can differ
+_PUNCTUATION = {cp: None for cp in range(0x10000) if unicodedata.category(chr(cp)).startswith('P')}
+
+_rng = np.random.default_rng(1)
+_A = _rng.integers(1, _PRIME, NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, NUM_PERM, dtype=np.uint64)
+
+
+def near_key(text):
+    return re.sub(r'\s+', ' ', text.translate(_PUNCTUATION)).strip()
+
+
+def shingles(key):
+    # Byte trigrams of the UTF-8 text packed into 24-bit integers: exact,
+    # collision-free and computed in one vectorized pass
+    data = np.frombuffer(key.encode('utf-8').ljust(SHINGLE_SIZE, b'\0'), np.uint8).astype(np.uint64)
+    return np.unique(data[:-2] << 16 | data[1:-1] << 8 | data[2:])
+
+
+def minhash(shingle_array):
+    return ((np.outer(_A, shingle_array) + _B[:, None]) % _PRIME).min(axis=1)
+
+
+def jaccard(a, b):
+    common = np.intersect1d(a, b, assume_unique=True).size
+    return common / (a.size + b.size - common)
+
+
+def deduplicate(texts, threshold=THRESHOLD, near=NEAR_DUPLICATES):
+    # Returns the indices of one representative text per cluster and, for
+    # every text, the position of its cluster in that list. Exact matches on
+    # the normalized text (case and whitespace only, as in the prediction
+    # cache) collapse first; with near=True the remaining texts, minus their
+    # punctuation, are grouped by MinHash/LSH and a candidate only joins a
+    # cluster when its Jaccard similarity to the cluster's representative
+    # clears the threshold, so clusters cannot drift through chains of small
+    # edits
+    representatives, assignment = [], []
+    exact = {}
+    buckets = {}
+    rep_shingles, rep_signatures = [], []
+    near_duplicates = 0
+    rows = NUM_PERM // BANDS
+
+    for i, text in enumerate(texts):
+        key = normalize_text(text)
+        if key in exact:
+            assignment.append(exact[key])
+            continue
+
+        cluster = None
+        key_shingles, signature, bands = None, None, []
+        if near and key:
+            key_shingles = shingles(near_key(key))
+            signature = minhash(key_shingles)
+            bands = [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(BANDS)]
+            candidates = sorted({candidate for band_key in bands for candidate in buckets.get(band_key, ())})
+            if candidates:
+                # The signature agreement estimates the similarity; only
+                # plausible candidates get the exact (and costlier) check
+                estimates = (np.stack([rep_signatures[c] for c in candidates]) == signature).mean(axis=1)
+                for position in np.argsort(-estimates, kind='stable'):
+                    if estimates[position] < threshold - 0.15:
+                        break
+                    if jaccard(key_shingles, rep_shingles[candidates[position]]) >= threshold:
+                        cluster = candidates[position]
+                        break
+        if cluster is not None:
+            near_duplicates += 1
+        else:
+            cluster = len(representatives)
+            representatives.append(i)
+            rep_shingles.append(key_shingles)
+            rep_signatures.append(signature)
+            for band_key in bands:
+                buckets.setdefault(band_key, []).append(cluster)
+        exact[key] = cluster
+        assignment.append(cluster)
+
+    stats = {
+        'texts': len(texts),
+        'classified': len(representatives),
+        'exact_duplicates': len(texts) - len(exact),
+        'near_duplicates': near_duplicates,
+        'dedup_ratio': round(1 - len(representatives) / len(texts), 4) if texts else 0.0
+    }
+    return representatives, assignment, stats
@@ -0,0 +1,35 @@
+from collections import Counter
+
+EMOTION_LABELS = ['admiration', 'amusement', 'anger', 'annoyance', 'approval', 'caring', 'confusion', 'curiosity', 'desire', 'disappointment', 'disapproval', 'disgust', 'embarrassment', 'excitement', 'fear', 'gratitude', 'grief', 'joy', 'love', 'nervousness', 'optimism', 'pride', 'realization', 'relief', 'remorse', 'sadness', 'surprise', 'neutral']
+POSITIVE_EMOTIONS = ['admiration', 'amusement', 'approval', 'caring', 'desire', 'excitement', 'gratitude', 'joy', 'love', 'optimism', 'pride', 'realization', 'relief']
+NEGATIVE_EMOTIONS = ['anger', 'annoyance', 'disappointment', 'disapproval', 'disgust', 'embarrassment', 'fear', 'grief', 'nervousness', 'remorse', 'sadness']
+CATEGORIES = ['Positive', 'Negative', 'Neutral']
+
+# Built once so mapping a label is a hash lookup instead of list scans
+LABEL_CATEGORY = {label: 'Neutral' for label in EMOTION_LABELS}
+LABEL_CATEGORY.update({label: 'Positive' for label in POSITIVE_EMOTIONS})
+LABEL_CATEGORY.update({label: 'Negative' for label in NEGATIVE_EMOTIONS})
+
+
+def emotion_category(label):
+    return LABEL_CATEGORY.get(label, 'Neutral')
+
+
+class EmotionTally:
+    def __init__(self):
+        self.total = 0
+        self.labels = Counter()
+        self.categories = Counter()
+
+    def update(self, labels):
+        counts = Counter(labels)
+        self.total += sum(counts.values())
+        self.labels.update(counts)
+        for label, count in counts.items():
+            self.categories[emotion_category(label)] += count
+
+    def category_counts(self):
+        return [{'Emotion Category': category, 'Count': count} for category, count in self.categories.most_common()]
+
+    def label_counts(self):
+        return [{'Emotion': label, 'Count': count} for label, count in self.labels.most_common()]
@@ -0,0 +1,169 @@
+import asyncio
+import os
+import random
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from archive import ARCHIVE_ENABLED, get_archive, is_fresh, validators
+from metrics import incr
+
+HEADERS = {
+    'User-Agent': 'Your_User_Agent_Here',
+    'Accept-Language': 'en-us,en;q=0.5'
+}
+
+CONCURRENCY = int(os.environ.get('SCRAPE_CONCURRENCY', 8))
+RATE_PER_HOST = float(os.environ.get('SCRAPE_RATE_PER_HOST', 5.0))
+BURST = int(os.environ.get('SCRAPE_BURST', 5))
+TIMEOUT = float(os.environ.get('SCRAPE_TIMEOUT', 15))
+RETRIES = int(os.environ.get('SCRAPE_RETRIES', 3))
+BACKOFF = float(os.environ.get('SCRAPE_BACKOFF', 0.5))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class HostRateLimiter:
+    def __init__(self, rate=RATE_PER_HOST, burst=BURST):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+
+    async def acquire(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate, self.burst)
+        await self.buckets[host].acquire()
+
+
+async def fetch_page(session, url, limiter, stats, retries=RETRIES, backoff=BACKOFF, archive=None, product=None):
+    # With an archive, a fresh archived copy is served without a request, a
+    # stale one is revalidated, and every new body is archived. Archive calls
+    # compress and commit to SQLite, so they run off the event loop
+    cached = await asyncio.to_thread(archive.latest, url) if archive else None
+    if cached is not None and is_fresh(cached):
+        stats['cached'] += 1
+        incr('archive_hits')
+        return await asyncio.to_thread(archive.read, cached)
+    headers = validators(cached) if cached is not None else None
+
+    for attempt in range(retries + 1):
+        await limiter.acquire(url)
+        try:
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304 and cached is not None:
+                    await asyncio.to_thread(archive.refresh, cached, dict(response.headers), product)
+                    stats['not_modified'] += 1
+                    incr('archive_not_modified')
+                    return await asyncio.to_thread(archive.read, cached)
+                response.raise_for_status()
+                content = await response.read()
+                if archive:
+                    await asyncio.to_thread(archive.put, url, content, dict(response.headers), response.status, product)
+                return content
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            retryable = not isinstance(error, aiohttp.ClientResponseError) or error.status in RETRY_STATUSES
+            if not retryable or attempt == retries:
+                raise
+            stats['retries'] += 1
+            # Exponential backoff with jitter so parallel retries spread out
+            await asyncio.sleep(backoff * 2 ** attempt * (1 + random.random()))
+
+
+def open_session(concurrency=CONCURRENCY, timeout=TIMEOUT, headers=HEADERS):
+    # Must be called with the event loop that will use the session running
+    connector = aiohttp.TCPConnector(limit=concurrency, keepalive_timeout=30)
+    return aiohttp.ClientSession(headers=headers, connector=connector, timeout=aiohttp.ClientTimeout(total=timeout))
+
+
+async def fetch_all(urls, concurrency=CONCURRENCY, rate=RATE_PER_HOST, burst=BURST,
+                    timeout=TIMEOUT, retries=RETRIES, backoff=BACKOFF, headers=HEADERS, limiter=None,
+                    archive=None, product=None, session=None):
+    stats = {'pages': len(urls), 'failed': 0, 'retries': 0, 'cached': 0, 'not_modified': 0, 'seconds': 0.0}
+    start = time.perf_counter()
+    limiter = limiter or HostRateLimiter(rate, burst)
+    # archive=False turns the page archive off for one call
+    if archive is None and ARCHIVE_ENABLED:
+        archive = get_archive()
+    semaphore = asyncio.Semaphore(concurrency)
+    # A session passed in belongs to the caller and stays open
+    owned = session is None
+    session = session or open_session(concurrency, timeout, headers)
+
+    async def bounded(url):
+        async with semaphore:
+            return await fetch_page(session, url, limiter, stats, retries, backoff, archive, product)
+
+    try:
+        results = await asyncio.gather(*(bounded(url) for url in urls), return_exceptions=True)
+    finally:
+        if owned:
+            await session.close()
+
+    # gather keeps input order, so pages come back in page order; a page
+    # that still fails after all retries is returned as None
+    pages = []
+    for result in results:
+        if isinstance(result, BaseException):
+            stats['failed'] += 1
+            pages.append(None)
+        else:
+            pages.append(result)
+    stats['seconds'] = time.perf_counter() - start
+    return pages, stats
+
+
+def fetch_pages(urls, **kwargs):
+    return asyncio.run(fetch_all(list(urls), **kwargs))
+
+
+class PageFetcher:
+    # Keeps one event loop, client session and rate limiter across several
+    # fetch_pages-style calls, so the windows of one pagination share
+    # keep-alive connections and one per-host budget
+    def __init__(self, concurrency=CONCURRENCY, rate=RATE_PER_HOST, burst=BURST, timeout=TIMEOUT,
+                 headers=HEADERS, limiter=None):
+        self.concurrency = concurrency
+        self.limiter = limiter or HostRateLimiter(rate, burst)
+        self.loop = asyncio.new_event_loop()
+        self.session = self.loop.run_until_complete(self._open(concurrency, timeout, headers))
+
+    async def _open(self, concurrency, timeout, headers):
+        return open_session(concurrency, timeout, headers)
+
+    def fetch(self, urls, **kwargs):
+        return self.loop.run_until_complete(fetch_all(
+            list(urls), self.concurrency, limiter=self.limiter, session=self.session, **kwargs
+        ))
+
+    def close(self):
+        if not self.loop.is_closed():
+            self.loop.run_until_complete(self.session.close())
+            self.loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
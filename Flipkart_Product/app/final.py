@@ -1,9 +1,14 @@
 import streamlit as st
 import pandas as pd
-from transformers import pipeline
 import plotly.express as px
-import requests
-from bs4 import BeautifulSoup
+from fetcher import fetch_pages
+from review_parser import COLUMNS, parse_page
+from inference import classify_cached, summarize_throughput
+from models import EMOTION_MODEL, cache_model_id, get_model, warm_up
+from cache import get_cache
+from emotions import EmotionTally
+from ingest import detect_encoding, iter_csv_column
+from streaming import analyze_chunks
 
 st.set_page_config(
     page_title="Sentiment Analysis tool",
@@ -15,51 +20,51 @@ st.title("Real Time Brand Monitering and Interactive Analysis💕")
 
 detected_emotions_list = []
 
-emotion = pipeline('sentiment-analysis', model='arpanghoshal/EmoRoBERTa')
-
-def process_csv_input(file):
-    encoding_list = ['utf-8', 'latin-1', 'ISO-8859-1']
-
-    for encoding in encoding_list:
-        try:
-            df = pd.read_csv(file, encoding=encoding)
-            st.success(f"CSV file successfully loaded using encoding: {encoding}")
-            st.table(df)  
-            sentences = df["Sentence"].tolist()
-            perform_emotion_analysis(sentences)
-            break  
-        except UnicodeDecodeError:
-            st.warning(f"Failed to decode using encoding: {encoding}")
-            continue 
-    else:
-        st.error("Unable to decode the CSV file using any of the tried encodings. Please check the file encoding.")
+warm_up()
+
+def process_csv_input(file, column="Sentence"):
+    # The encoding is sniffed once and the file is classified in chunks, so
+    # only the running tally and the latest rows are ever held in memory
+    encoding = detect_encoding(file)
+    st.success(f"CSV file successfully loaded using encoding: {encoding}")
+    progress = st.empty()
+    table = st.empty()
+    tally = EmotionTally()
+    try:
+        for update in analyze_chunks(iter_csv_column(file, column, encoding), get_model('emotion'), cache_model_id(EMOTION_MODEL), get_cache()):
+            progress.caption(f"{update['stats']['rows']} rows classified from {update['stats']['chunks']} chunks...")
+            table.dataframe(pd.DataFrame(list(update['recent']), columns=[column, "Detected_Emotion"]))
+            tally = update['tally']
+    except ValueError as error:
+        st.error(f"Unable to read the '{column}' column from the CSV file: {error}")
+    return tally
 
 def perform_emotion_analysis(sentences):
     detected_emotions_list.clear() 
-    for sentence in sentences:
-        emotion_labels = emotion(sentence)
-        detected_emotion = emotion_labels[0]['label']
+    predictions, batch_stats = classify_cached(get_model('emotion'), cache_model_id(EMOTION_MODEL), sentences, get_cache())
+    for sentence, emotion_labels in zip(sentences, predictions):
+        detected_emotion = emotion_labels['label']
         detected_emotions_list.append((sentence, detected_emotion))
 
     st.write("Analysis Results:")
     result_df = pd.DataFrame(detected_emotions_list, columns=["Sentence", "Detected_Emotion"])
     st.table(result_df)
-
-def plot_emotions():
+    cache_stats = get_cache().stats()
+    st.caption(f"Prediction cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['entries']} entries")
+    if batch_stats:
+        st.caption(summarize_throughput(batch_stats))
+        with st.expander("Per-batch throughput"):
+            st.table(pd.DataFrame(batch_stats))
+
+    tally = EmotionTally()
+    tally.update(label for _, label in detected_emotions_list)
+    return tally
+
+def plot_emotions(tally):
     st.header("Detected Emotions Distribution")
 
-    if detected_emotions_list:
-        df_emotions = pd.DataFrame(detected_emotions_list, columns=['Sentence', 'Detected_Emotion'])
-
-        emotion_counts = df_emotions['Detected_Emotion'].value_counts().reset_index()
-        emotion_counts.columns = ['Emotion', 'Count']
-
-        positive_emotions = ['admiration', 'amusement', 'approval', 'caring', 'desire', 'excitement', 'gratitude', 'joy', 'love', 'optimism', 'pride', 'realization', 'relief']
-        negative_emotions = ['anger', 'annoyance', 'disappointment', 'disapproval', 'disgust', 'embarrassment', 'fear', 'grief', 'nervousness', 'remorse', 'sadness']
-        df_emotions['Emotion Category'] = df_emotions['Detected_Emotion'].apply(lambda x: 'Positive' if x in positive_emotions else ('Negative' if x in negative_emotions else 'Neutral'))
-
-        emotion_category_counts = df_emotions['Emotion Category'].value_counts().reset_index()
-        emotion_category_counts.columns = ['Emotion Category', 'Count']
+    if tally.total:
+        emotion_category_counts = pd.DataFrame(tally.category_counts())
 
         fig_bar = px.bar(emotion_category_counts, x='Emotion Category', y='Count', labels={'Emotion Category': 'Emotion Category', 'Count': 'Count'}, color='Emotion Category')
         st.plotly_chart(fig_bar)
@@ -70,51 +75,13 @@ def plot_emotions():
         st.info("No emotions detected yet.")
 
 def scrape_reviews_and_save_to_csv(product_name, url):
-    headers = {
-        'User-Agent': 'Your_User_Agent_Here',
-        'Accept-Language': 'en-us,en;q=0.5'
-    }
-
-    customer_names = []
-    review_title = []
-    ratings = []
-    comments = []
-
-    for i in range(1, 44):
-        page = requests.get(url.format(i), headers=headers)
-        soup = BeautifulSoup(page.content, 'html.parser')
-
-        names = soup.find_all('p', class_='_2sc7ZR')
-        for name in names:
-            customer_names.append(name.get_text(strip=True))
-
-        titles = soup.find_all('p', class_='_2-N8zT')
-        for title in titles:
-            review_title.append(title.get_text(strip=True))
-
-        ratings_all = soup.find_all('div', class_='col _2wzgFH K0kLPL')
-        for rating in ratings_all:
-            ratings.append(rating.div.text.strip())
-
-        comments_all = soup.find_all('div', class_='t-ZTKy')
-        for comment in comments_all:
-            comment_text = comment.div.div.get_text(strip=True)
-            comments.append(comment_text)
-
-    min_length = min(len(customer_names), len(review_title), len(ratings), len(comments))
-    customer_names = customer_names[:min_length]
-    review_title =review_title = review_title[:min_length]
-    ratings = ratings[:min_length]
-    comments = comments[:min_length]
-
-    data = {
-        'Customer Name': customer_names,
-        'Review Title': review_title,
-        'Rating': ratings,
-        'Comment': comments
-    }
-
-    df = pd.DataFrame(data)
+    pages, fetch_stats = fetch_pages((url.format(i) for i in range(1, 44)), product=product_name)
+    reviews = []
+    for content in pages:
+        if content is not None:
+            reviews.extend(parse_page(content))
+
+    df = pd.DataFrame(reviews, columns=COLUMNS)
     df.to_csv(f'{product_name}_reviews.csv', index=False)
 
 def main():
@@ -137,16 +104,16 @@ def main():
     uploaded_file = st.file_uploader("Upload CSV", type=["csv"])
     if uploaded_file is not None:
         if st.button("Process CSV Input"):
-            process_csv_input(uploaded_file)
-            plot_emotions()
+            tally = process_csv_input(uploaded_file)
+            plot_emotions(tally)
 
     st.header("Text Input for Emotion Analysis")
     text_input = st.text_area("Type or paste your text here:", height=200)
     if st.button("Analyze Text"):
         if text_input.strip() != "":
             sentences = [text_input]
-            perform_emotion_analysis(sentences)
-            plot_emotions()
+            tally = perform_emotion_analysis(sentences)
+            plot_emotions(tally)
         else:
             st.warning("Please input some text to analyze.")
 
@@ -0,0 +1,156 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from cache import normalize_text
+from fetcher import CONCURRENCY, PageFetcher
+from metrics import incr, observe
+from review_parser import parse_page
+
+STATE_PATH = os.environ.get('SCRAPE_STATE_PATH', 'scrape_state.sqlite3')
+MAX_PAGES = int(os.environ.get('SCRAPE_MAX_PAGES', 43))
+
+
+def review_fingerprint(review):
+    key = '\x1f'.join(normalize_text(field) for field in review)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class ScrapeState:
+    def __init__(self, path=STATE_PATH):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS seen ('
+            'product TEXT, fingerprint TEXT, first_seen REAL, PRIMARY KEY (product, fingerprint))'
+        )
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS watermarks ('
+            'product TEXT PRIMARY KEY, last_run REAL, last_new_review REAL, pages INTEGER, total_reviews INTEGER)'
+        )
+        self.conn.commit()
+
+    def seen_among(self, product, fingerprints):
+        fingerprints = list(fingerprints)
+        if not fingerprints:
+            return set()
+        marks = ','.join('?' * len(fingerprints))
+        with self.lock:
+            rows = self.conn.execute(
+                f'SELECT fingerprint FROM seen WHERE product = ? AND fingerprint IN ({marks})',
+                [product] + fingerprints
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def unseen(self, product, fingerprints):
+        # Positions of the fingerprints not recorded for the product yet,
+        # keeping only the first of any repeats
+        known = self.seen_among(product, fingerprints)
+        fresh = {}
+        for i, fingerprint in enumerate(fingerprints):
+            if fingerprint not in known and fingerprint not in fresh:
+                fresh[fingerprint] = i
+        return list(fresh.values())
+
+    def mark_seen(self, product, fingerprints, pages):
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO seen VALUES (?, ?, ?)',
+                [(product, fingerprint, now) for fingerprint in fingerprints]
+            )
+            total = self.conn.execute('SELECT COUNT(*) FROM seen WHERE product = ?', (product,)).fetchone()[0]
+            previous = self.watermark(product, lock=False)
+            last_new = now if fingerprints else (previous['last_new_review'] if previous else None)
+            self.conn.execute(
+                'INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?, ?)',
+                (product, now, last_new, pages, total)
+            )
+            self.conn.commit()
+
+    def watermark(self, product, lock=True):
+        query = 'SELECT last_run, last_new_review, pages, total_reviews FROM watermarks WHERE product = ?'
+        if lock:
+            with self.lock:
+                row = self.conn.execute(query, (product,)).fetchone()
+        else:
+            row = self.conn.execute(query, (product,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(['last_run', 'last_new_review', 'pages', 'total_reviews'], row))
+
+
+_state = None
+_state_lock = threading.Lock()
+
+
+def get_state():
+    global _state
+    with _state_lock:
+        if _state is None:
+            _state = ScrapeState()
+        return _state
+
+
+def new_scrape_stats():
+    return {
+        'pages': 0, 'failed_pages': 0, 'reviews': 0, 'new_reviews': 0, 'stop': 'max_pages',
+        'fetch_seconds': 0.0, 'parse_seconds': 0.0
+    }
+
+
+def iter_page_reviews(page_urls, product=None, state=None, window=CONCURRENCY, stats=None, limiter=None, archive=None):
+    # Pages are fetched one concurrent window at a time so pagination can stop
+    # at the first empty page, or with a state, the first page with nothing new
+    page_urls = list(page_urls)
+    stats = stats if stats is not None else new_scrape_stats()
+    seen_now = set()
+
+    # One limiter and session for the whole pagination, so the per-host rate
+    # holds across windows and connections are reused
+    with PageFetcher(limiter=limiter) as fetcher:
+        for offset in range(0, len(page_urls), window):
+            pages, fetch_stats = fetcher.fetch(page_urls[offset:offset + window], archive=archive, product=product)
+            stats['fetch_seconds'] += fetch_stats['seconds']
+            observe('fetch', fetch_stats['seconds'])
+            incr('retries', fetch_stats['retries'])
+            for content in pages:
+                stats['pages'] += 1
+                incr('pages')
+                if content is None:
+                    stats['failed_pages'] += 1
+                    incr('failed_pages')
+                    continue
+                start = time.perf_counter()
+                page_reviews = parse_page(content)
+                elapsed = time.perf_counter() - start
+                stats['parse_seconds'] += elapsed
+                observe('parse', elapsed)
+                if not page_reviews:
+                    stats['stop'] = 'empty_page'
+                    return
+                stats['reviews'] += len(page_reviews)
+                incr('reviews', len(page_reviews))
+                page_fingerprints = [review_fingerprint(review) for review in page_reviews]
+
+                if state is None:
+                    yield page_reviews, page_fingerprints
+                    continue
+
+                known = state.seen_among(product, page_fingerprints) | seen_now
+                fresh = [(fp, review) for fp, review in zip(page_fingerprints, page_reviews) if fp not in known]
+                if not fresh:
+                    stats['stop'] = 'no_new_reviews'
+                    return
+                seen_now.update(fp for fp, _ in fresh)
+                stats['new_reviews'] += len(fresh)
+                yield [review for _, review in fresh], [fp for fp, _ in fresh]
+
+
+def most_recent_first(url):
+    # Early termination relies on new reviews showing up on the first pages
+    if 'sortOrder=' in url:
+        return url
+    return url + ('&' if '?' in url else '?') + 'sortOrder=MOST_RECENT'
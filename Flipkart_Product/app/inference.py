@@ -0,0 +1,215 @@
+import os
+import re
+import time
+
+from cache import cache_key
+from dedup import NEAR_DUPLICATES, deduplicate
+from metrics import incr, span
+
+DEFAULT_BATCH_SIZE = int(os.environ.get('EMOTION_BATCH_SIZE', 32))
+DEDUP = os.environ.get('EMOTION_DEDUP', '1') != '0'
+# Longest window, in tokens including the special tokens, sent to the model;
+# reviews longer than this are split instead of being truncated
+MAX_TOKENS = int(os.environ.get('EMOTION_MAX_TOKENS', 256))
+WINDOW_STRIDE = int(os.environ.get('EMOTION_WINDOW_STRIDE', 32))
+_SPECIAL_TOKENS = 2
+_SENTENCE_END = re.compile(r'(?<=[.!?\u0964])\s+|\s*\n+\s*')
+
+
+def token_lengths(tokenizer, texts):
+    # Fall back to character length when the classifier has no tokenizer
+    if tokenizer is None:
+        return [len(text) for text in texts]
+    encoded = tokenizer(texts, add_special_tokens=True, truncation=True)
+    return [len(ids) for ids in encoded['input_ids']]
+
+
+def length_buckets(lengths, batch_size):
+    # Sorting by length keeps similarly sized inputs together so each batch
+    # is only padded up to its own longest member
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def classify_batched(classifier, texts, batch_size=DEFAULT_BATCH_SIZE, **kwargs):
+    texts = [str(text) for text in texts]
+    results = [None] * len(texts)
+    batch_stats = []
+    if not texts:
+        return results, batch_stats
+
+    with span('tokenize'):
+        lengths = token_lengths(getattr(classifier, 'tokenizer', None), texts)
+    for batch in length_buckets(lengths, max(1, batch_size)):
+        with span('forward'):
+            start = time.perf_counter()
+            outputs = classifier([texts[i] for i in batch], batch_size=len(batch), truncation=True, **kwargs)
+            elapsed = time.perf_counter() - start
+
+        for i, output in zip(batch, outputs):
+            results[i] = output
+        batch_stats.append({
+            'Batch': len(batch_stats) + 1,
+            'Size': len(batch),
+            'Max Tokens': lengths[batch[-1]],
+            'Seconds': round(elapsed, 4),
+            'Reviews/sec': round(len(batch) / elapsed, 1) if elapsed > 0 else float('inf')
+        })
+    return results, batch_stats
+
+
+def count_tokens(tokenizer, texts):
+    if tokenizer is None:
+        return [len(text.split()) for text in texts]
+    return [len(ids) for ids in tokenizer(texts, add_special_tokens=False)['input_ids']]
+
+
+def token_slices(tokenizer, text, budget, stride=WINDOW_STRIDE):
+    # A single sentence longer than the budget is cut into overlapping
+    # token windows so no part of it is dropped
+    if tokenizer is None:
+        pieces = text.split()
+        join = ' '.join
+    else:
+        pieces = tokenizer(text, add_special_tokens=False)['input_ids']
+        join = tokenizer.decode
+    step = max(1, budget - stride)
+    chunks = [pieces[start:start + budget] for start in range(0, max(1, len(pieces) - stride), step)]
+    return [(join(chunk), len(chunk)) for chunk in chunks]
+
+
+def split_windows(text, tokenizer=None, max_tokens=MAX_TOKENS):
+    # Returns (window, token count) pairs. Whole sentences are packed into
+    # each window up to the budget; most reviews fit in one window, and
+    # their UTF-8 length (a bound on BPE and WordPiece token counts) says so
+    # without tokenizing
+    budget = max(8, max_tokens - _SPECIAL_TOKENS)
+    if len(text.encode('utf-8')) <= budget:
+        return [(text, None)]
+    sentences = [sentence for sentence in _SENTENCE_END.split(text) if sentence.strip()]
+    lengths = count_tokens(tokenizer, sentences)
+    if sum(lengths) <= budget:
+        return [(text, sum(lengths))]
+
+    windows, current, size = [], [], 0
+    for sentence, length in zip(sentences, lengths):
+        if current and size + length > budget:
+            windows.append((' '.join(current), size))
+            current, size = [], 0
+        if length > budget:
+            windows.extend(token_slices(tokenizer, sentence, budget))
+            continue
+        current.append(sentence)
+        size += length
+    if current:
+        windows.append((' '.join(current), size))
+    return windows
+
+
+def merge_window_outputs(outputs, weights):
+    # Token-weighted mean of each label's score over a review's windows
+    totals = {}
+    for output, weight in zip(outputs, weights):
+        for item in ([output] if isinstance(output, dict) else output):
+            totals[item['label']] = totals.get(item['label'], 0.0) + item['score'] * weight
+    total_weight = sum(weights)
+    return [{'label': label, 'score': score / total_weight} for label, score in totals.items()]
+
+
+def classify_windows(classifier, texts, batch_size=DEFAULT_BATCH_SIZE, max_tokens=MAX_TOKENS):
+    # Every window of every review goes through the same length-bucketed
+    # batches, then the window scores are folded back into one result per
+    # review
+    tokenizer = getattr(classifier, 'tokenizer', None)
+    windows, owners, weights = [], [], []
+    for i, text in enumerate(texts):
+        pieces = split_windows(text, tokenizer, max_tokens)
+        if len(pieces) > 1:
+            incr('long_reviews')
+            incr('windows', len(pieces))
+        for piece, length in pieces:
+            windows.append(piece)
+            owners.append(i)
+            weights.append(length or 1)
+
+    outputs, batch_stats = classify_batched(classifier, windows, batch_size, top_k=None)
+    if len(windows) == len(texts):
+        return [to_prediction(output) for output in outputs], batch_stats
+
+    grouped = [([], []) for _ in texts]
+    for owner, output, weight in zip(owners, outputs, weights):
+        grouped[owner][0].append(output)
+        grouped[owner][1].append(weight)
+    return [to_prediction(merge_window_outputs(*group)) for group in grouped], batch_stats
+
+
+def summarize_throughput(batch_stats):
+    total = sum(stat['Size'] for stat in batch_stats)
+    seconds = sum(stat['Seconds'] for stat in batch_stats)
+    rate = total / seconds if seconds > 0 else float('inf')
+    return f"Classified {total} reviews in {len(batch_stats)} batches ({seconds:.2f}s, {rate:.1f} reviews/sec)"
+
+
+def to_prediction(output):
+    # top_k=None yields every label with its score; keep them all so the
+    # cache can answer later questions without rerunning the model
+    if isinstance(output, dict):
+        output = [output]
+    best = max(output, key=lambda item: item['score'])
+    return {
+        'label': best['label'],
+        'score': best['score'],
+        'scores': {item['label']: item['score'] for item in output}
+    }
+
+
+def classify_predictions(classifier, texts, batch_size=DEFAULT_BATCH_SIZE):
+    # Worker pools shard the texts themselves; plain pipelines are batched here
+    if hasattr(classifier, 'classify_texts'):
+        # Workers time their own stages in their own process; from here the
+        # whole sharded call counts as the forward pass
+        with span('forward'):
+            return classifier.classify_texts(texts, batch_size)
+    return classify_windows(classifier, texts, batch_size)
+
+
+def classify_cached(classifier, model_id, texts, cache=None, batch_size=DEFAULT_BATCH_SIZE, dedup=DEDUP, stats=None,
+                    near=NEAR_DUPLICATES):
+    texts = [str(text) for text in texts]
+    if dedup and len(texts) > 1:
+        # Only one review per cluster of identical ones (after normalizing
+        # case and whitespace) is classified, and with near=True of
+        # near-identical ones; every member gets its representative's
+        # prediction
+        representatives, assignment, dedup_stats = deduplicate(texts, near=near)
+        incr('dedup_texts', dedup_stats['texts'])
+        incr('dedup_classified', dedup_stats['classified'])
+        if stats is not None:
+            for name in ('texts', 'classified', 'exact_duplicates', 'near_duplicates'):
+                stats[name] = stats.get(name, 0) + dedup_stats[name]
+            stats['dedup_ratio'] = round(1 - stats['classified'] / stats['texts'], 4) if stats['texts'] else 0.0
+        predictions, batch_stats = classify_cached(
+            classifier, model_id, [texts[i] for i in representatives], cache, batch_size, dedup=False
+        )
+        return [predictions[cluster] for cluster in assignment], batch_stats
+
+    if cache is None:
+        return classify_predictions(classifier, texts, batch_size)
+
+    keys = [cache_key(model_id, text) for text in texts]
+    found = cache.get_many(keys)
+
+    # Only texts the cache has never seen reach the model, each one once
+    pending = {}
+    for key, text in zip(keys, texts):
+        if key not in found and key not in pending:
+            pending[key] = text
+
+    incr('cache_hits', sum(1 for key in keys if key in found))
+    incr('cache_misses', len(pending))
+    predictions, batch_stats = classify_predictions(classifier, list(pending.values()), batch_size)
+    fresh = list(zip(pending, predictions))
+    if fresh:
+        cache.put_many(model_id, fresh)
+        found.update(fresh)
+    return [found[key] for key in keys], batch_stats
@@ -0,0 +1,53 @@
+import codecs
+import os
+
+import pandas as pd
+
+from review_parser import COLUMNS, Review, parse_rating
+
+SAMPLE_BYTES = 64 * 1024
+CHUNK_ROWS = int(os.environ.get('CSV_CHUNK_ROWS', 5000))
+
+
+def detect_encoding(file, sample_bytes=SAMPLE_BYTES):
+    position = file.tell()
+    sample = file.read(sample_bytes)
+    file.seek(position)
+
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        sample.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError as error:
+        # A multi-byte character cut in half by the sample boundary is not
+        # evidence against UTF-8
+        if len(sample) == sample_bytes and error.start >= len(sample) - 3 and error.reason == 'unexpected end of data':
+            return 'utf-8'
+    # latin-1 maps every byte, so it always decodes, as in the old retry loop
+    return 'latin-1'
+
+
+def iter_csv_column(file, column='Comment', encoding=None, chunk_rows=CHUNK_ROWS):
+    encoding = encoding or detect_encoding(file)
+    reader = pd.read_csv(
+        file, encoding=encoding, encoding_errors='replace', usecols=[column],
+        dtype={column: 'string'}, chunksize=chunk_rows
+    )
+    with reader:
+        for chunk in reader:
+            yield chunk[column].dropna().tolist()
+
+
+def iter_csv_reviews(file, encoding=None, chunk_rows=CHUNK_ROWS):
+    # Reads whichever of the scraper's columns the file has; missing ones stay empty
+    encoding = encoding or detect_encoding(file)
+    reader = pd.read_csv(
+        file, encoding=encoding, encoding_errors='replace', usecols=lambda name: name in COLUMNS,
+        dtype='string', chunksize=chunk_rows, keep_default_na=False
+    )
+    with reader:
+        for chunk in reader:
+            columns = [chunk[name].tolist() if name in chunk else [''] * len(chunk) for name in COLUMNS]
+            yield [Review(name, title, parse_rating(rating), comment)
+                   for name, title, rating, comment in zip(*columns) if comment]
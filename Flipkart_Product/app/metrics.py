@@ -0,0 +1,181 @@
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_PATH = os.environ.get('METRICS_EXPORT_PATH')
+PROFILE_DIR = os.environ.get('PROFILE_DIR')
+# How long a profiled block waits for the threads it started to finish
+# before writing the profile without them
+PROFILE_THREAD_WAIT = 5.0
+PREFIX = 'review_pipeline'
+
+STAGES = ['fetch', 'parse', 'tokenize', 'forward', 'dataframe', 'render', 'csv', 'store']
+
+
+class Metrics:
+    # Process-wide timers and counters; spans may close on the scraping
+    # thread while the UI thread reads a snapshot, hence the lock
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.spans = {}
+            self.counters = {}
+            self.started = time.time()
+
+    def observe(self, stage, seconds, count=1):
+        with self.lock:
+            span = self.spans.setdefault(stage, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            span['calls'] += count
+            span['seconds'] += seconds
+            span['max_seconds'] = max(span['max_seconds'], seconds)
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self.lock:
+            spans = {stage: dict(span) for stage, span in self.spans.items()}
+            counters = dict(self.counters)
+            started = self.started
+        order = {stage: i for i, stage in enumerate(STAGES)}
+        return {
+            'since': started,
+            'seconds': round(time.time() - started, 3),
+            'stages': dict(sorted(spans.items(), key=lambda item: order.get(item[0], len(order)))),
+            'counters': dict(sorted(counters.items()))
+        }
+
+    def stage_rows(self):
+        return [{
+            'Stage': stage,
+            'Calls': span['calls'],
+            'Seconds': round(span['seconds'], 4),
+            'Mean ms': round(span['seconds'] * 1000 / span['calls'], 2) if span['calls'] else None,
+            'Max ms': round(span['max_seconds'] * 1000, 2)
+        } for stage, span in self.snapshot()['stages'].items()]
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        snapshot = self.snapshot()
+        lines = [
+            f'# HELP {PREFIX}_stage_seconds_total Time spent in each pipeline stage',
+            f'# TYPE {PREFIX}_stage_seconds_total counter'
+        ]
+        lines += [f'{PREFIX}_stage_seconds_total{{stage="{stage}"}} {span["seconds"]:.6f}'
+                  for stage, span in snapshot['stages'].items()]
+        lines += [f'# TYPE {PREFIX}_stage_calls_total counter']
+        lines += [f'{PREFIX}_stage_calls_total{{stage="{stage}"}} {span["calls"]}'
+                  for stage, span in snapshot['stages'].items()]
+        lines += [f'# TYPE {PREFIX}_stage_max_seconds gauge']
+        lines += [f'{PREFIX}_stage_max_seconds{{stage="{stage}"}} {span["max_seconds"]:.6f}'
+                  for stage, span in snapshot['stages'].items()]
+        for name, value in snapshot['counters'].items():
+            lines += [f'# TYPE {PREFIX}_{name}_total counter', f'{PREFIX}_{name}_total {value}']
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path=None):
+        # .prom/.txt files get the Prometheus text format (for node_exporter's
+        # textfile collector), anything else JSON
+        path = path or METRICS_PATH
+        if not path:
+            return None
+        body = self.to_prometheus() if path.endswith(('.prom', '.txt')) else self.to_json()
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as f:
+            f.write(body)
+        os.replace(temporary, path)
+        return path
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+        return _metrics
+
+
+def span(stage):
+    return get_metrics().span(stage)
+
+
+def incr(name, value=1):
+    get_metrics().incr(name, value)
+
+
+def observe(stage, seconds, count=1):
+    get_metrics().observe(stage, seconds, count)
+
+
+_profiling = threading.local()
+
+
+def profile_thread(target):
+    # Wraps the target of a thread started inside a profiled() block so the
+    # thread gets its own profiler, merged into the block's .prof file;
+    # cProfile only sees the thread that enabled it
+    threads = getattr(_profiling, 'threads', None)
+    if threads is None:
+        return target
+    profiler, done = cProfile.Profile(), threading.Event()
+    threads.append((profiler, done))
+
+    def run(*args, **kwargs):
+        profiler.enable()
+        try:
+            return target(*args, **kwargs)
+        finally:
+            profiler.disable()
+            done.set()
+    return run
+
+
+@contextmanager
+def profiled(name='run', directory=PROFILE_DIR, enabled=None):
+    # Opt-in: with PROFILE_DIR set (or enabled=True) the block runs under
+    # cProfile and the stats are dumped for snakeviz/pstats. Sampling
+    # profilers need nothing from here: py-spy record --pid <pid>
+    if not (directory if enabled is None else enabled):
+        yield None
+        return
+    directory = directory or '.'
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof")
+    profiler = cProfile.Profile()
+    outer, _profiling.threads = getattr(_profiling, 'threads', None), []
+    threads = _profiling.threads
+    profiler.enable()
+    try:
+        yield path
+    finally:
+        profiler.disable()
+        _profiling.threads = outer
+        stats = pstats.Stats(profiler)
+        for thread_profiler, done in threads:
+            # A thread still blocked on I/O is left out rather than read
+            # while its profiler is running
+            if done.wait(PROFILE_THREAD_WAIT):
+                stats.add(thread_profiler)
+        stats.dump_stats(path)
@@ -0,0 +1,226 @@
+import argparse
+import gc
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+EMOTION_MODEL = 'arpanghoshal/EmoRoBERTa'
+SENTIMENT_MODEL = 'distilbert-base-uncased-finetuned-sst-2-english'
+
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'torch')
+# The ONNX backend runs the int8 quantized export unless this is 0
+ONNX_QUANTIZE = os.environ.get('ONNX_QUANTIZE', '1') != '0'
+MEMORY_BUDGET_MB = float(os.environ.get('MODEL_MEMORY_BUDGET_MB', 2048))
+WARM_UP_MODELS = [name for name in os.environ.get('WARM_UP_MODELS', 'emotion').split(',') if name]
+
+# Offline mode loads pinned snapshots from disk and never contacts the hub
+MODEL_OFFLINE = os.environ.get('MODEL_OFFLINE', '0') == '1'
+SNAPSHOT_DIR = os.environ.get('MODEL_SNAPSHOT_DIR', 'model_snapshots')
+MODEL_REVISIONS = {
+    EMOTION_MODEL: os.environ.get('EMOTION_MODEL_REVISION'),
+    SENTIMENT_MODEL: os.environ.get('SENTIMENT_MODEL_REVISION'),
+}
+
+# Module level state lives for the whole server process, so every Streamlit
+# session and script rerun shares the same loaded models
+_lock = threading.RLock()
+_specs = {}
+_loaded = OrderedDict()
+# Loading happens outside the registry lock, one lock per model, so a slow
+# load does not block lookups of other models
+_loading = {}
+_errors = {}
+_warm_up_thread = None
+
+
+def register_model(name, loader, size_mb=None):
+    with _lock:
+        _specs[name] = {'loader': loader, 'size_mb': size_mb, 'load_seconds': None}
+
+
+def model_size_mb(model):
+    if getattr(model, 'size_mb', None) is not None:
+        return model.size_mb
+    inner = getattr(model, 'model', model)
+    parameters = getattr(inner, 'parameters', None)
+    if parameters is None:
+        return 0.0
+    try:
+        return sum(p.numel() * p.element_size() for p in parameters()) / 2 ** 20
+    except (TypeError, AttributeError):
+        return 0.0
+
+
+def loaded_size_mb():
+    return sum(size for _, size in _loaded.values())
+
+
+def _make_room(size_mb):
+    # Least recently used models go first; a model bigger than the whole
+    # budget is still loaded, it just ends up alone
+    while _loaded and loaded_size_mb() + size_mb > MEMORY_BUDGET_MB:
+        oldest = next(iter(_loaded))
+        _loaded.pop(oldest)
+    gc.collect()
+
+
+def get_model(name):
+    with _lock:
+        if name in _loaded:
+            _loaded.move_to_end(name)
+            return _loaded[name][0]
+        if name not in _specs:
+            raise KeyError(f"Model '{name}' is not registered")
+        loading = _loading.setdefault(name, threading.Lock())
+
+    # A caller arriving while the model loads (e.g. during warm-up) waits
+    # for that load instead of starting a second one
+    with loading:
+        with _lock:
+            if name in _loaded:
+                _loaded.move_to_end(name)
+                return _loaded[name][0]
+            spec = _specs[name]
+            if spec['size_mb'] is not None:
+                _make_room(spec['size_mb'])
+
+        start = time.perf_counter()
+        try:
+            model = spec['loader']()
+        except Exception as error:
+            _errors[name] = f'{type(error).__name__}: {error}'
+            raise
+        _errors.pop(name, None)
+
+        with _lock:
+            spec['load_seconds'] = time.perf_counter() - start
+            size_mb = spec['size_mb'] if spec['size_mb'] is not None else model_size_mb(model)
+            _make_room(size_mb)
+            _loaded[name] = (model, size_mb)
+        return model
+
+
+def warm_up(names=None):
+    for name in names if names is not None else WARM_UP_MODELS:
+        get_model(name)
+
+
+def warm_up_async(names=None):
+    # Starts loading the models on a daemon thread, once per process, so the
+    # UI can render while the weights load
+    global _warm_up_thread
+
+    def run():
+        for name in names if names is not None else WARM_UP_MODELS:
+            try:
+                get_model(name)
+            except Exception:
+                pass  # recorded in _errors and raised again on first real use
+
+    with _lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=run, name='model-warm-up', daemon=True)
+            _warm_up_thread.start()
+        return _warm_up_thread
+
+
+def model_status(name):
+    with _lock:
+        if name in _loaded:
+            return 'ready'
+        if name in _errors:
+            return 'error'
+        loading = _loading.get(name)
+    return 'loading' if loading is not None and loading.locked() else 'not loaded'
+
+
+def model_error(name):
+    return _errors.get(name)
+
+
+def registry_stats():
+    with _lock:
+        return [{
+            'Model': name,
+            'Loaded': name in _loaded,
+            'Size (MB)': round(_loaded[name][1], 1) if name in _loaded else None,
+            'Load Seconds': round(spec['load_seconds'], 2) if spec['load_seconds'] is not None else None
+        } for name, spec in _specs.items()]
+
+
+def cache_model_id(model):
+    # Backends, int8 vs fp32 weights and the window size and overlap used for
+    # long reviews all change the scores, so each combination keeps its own
+    # prediction cache entries
+    from inference import MAX_TOKENS, WINDOW_STRIDE
+
+    backend = f"onnx-{'int8' if ONNX_QUANTIZE else 'fp32'}" if INFERENCE_BACKEND == 'onnx' else INFERENCE_BACKEND
+    return f"{model}@{backend};window={MAX_TOKENS}/{WINDOW_STRIDE}"
+
+
+def snapshot_path(model_id, root=SNAPSHOT_DIR):
+    return os.path.join(root, model_id.replace('/', '__'))
+
+
+def download_snapshot(model_id, revision=None, root=SNAPSHOT_DIR):
+    # Saves the model files at a fixed commit for offline use; the resolved
+    # commit is recorded next to them so the snapshot stays reproducible
+    from huggingface_hub import HfApi, snapshot_download
+
+    revision = revision or MODEL_REVISIONS.get(model_id)
+    commit = HfApi().model_info(model_id, revision=revision).sha
+    path = snapshot_path(model_id, root)
+    snapshot_download(model_id, revision=commit, local_dir=path)
+    with open(os.path.join(path, 'snapshot.json'), 'w') as f:
+        json.dump({'model': model_id, 'revision': commit, 'downloaded': time.time()}, f)
+    return path, commit
+
+
+def model_source(model_id):
+    if not MODEL_OFFLINE:
+        return model_id
+    path = snapshot_path(model_id)
+    if not os.path.isdir(path):
+        raise FileNotFoundError(f"No local snapshot of {model_id} in {path}; run 'python models.py snapshot' while online")
+    return path
+
+
+def _pipeline_loader(task, model):
+    def load():
+        if MODEL_OFFLINE:
+            # Must be set before transformers is imported
+            os.environ['HF_HUB_OFFLINE'] = '1'
+            os.environ['TRANSFORMERS_OFFLINE'] = '1'
+        if INFERENCE_BACKEND == 'onnx':
+            from onnx_backend import load_onnx_classifier
+            return load_onnx_classifier(model, ONNX_QUANTIZE)
+        from transformers import pipeline
+        if MODEL_OFFLINE:
+            return pipeline(task, model=model_source(model))
+        return pipeline(task, model=model, revision=MODEL_REVISIONS.get(model))
+    return load
+
+
+register_model('emotion', _pipeline_loader('sentiment-analysis', EMOTION_MODEL))
+register_model('sentiment', _pipeline_loader('sentiment-analysis', SENTIMENT_MODEL))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Download pinned model snapshots for offline mode (MODEL_OFFLINE=1)")
+    parser.add_argument('command', choices=['snapshot'])
+    parser.add_argument('--models', nargs='+', default=[EMOTION_MODEL, SENTIMENT_MODEL])
+    parser.add_argument('--revision', help="commit, tag or branch to pin (default: *_MODEL_REVISION or main)")
+    parser.add_argument('--root', default=SNAPSHOT_DIR)
+    args = parser.parse_args(argv)
+
+    for model_id in args.models:
+        path, commit = download_snapshot(model_id, args.revision, args.root)
+        print(f"{model_id}@{commit} -> {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
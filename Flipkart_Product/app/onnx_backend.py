@@ -0,0 +1,181 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+ONNX_DIR = os.environ.get('ONNX_MODEL_DIR', 'onnx_models')
+INTRA_OP_THREADS = int(os.environ.get('ORT_INTRA_OP_THREADS', os.cpu_count() or 1))
+INTER_OP_THREADS = int(os.environ.get('ORT_INTER_OP_THREADS', 1))
+MAX_LENGTH = 512
+
+# Distinguishes "top_k not given" (one dict per text) from top_k=None
+_TOP_ONE = object()
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'fixtures', 'parity_reviews.txt')
+
+
+def model_dir(model_id, root=ONNX_DIR):
+    return os.path.join(root, model_id.replace('/', '__'))
+
+
+def export_model(model_id, output_dir):
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+    from models import model_source
+
+    source = model_source(model_id)
+    tokenizer = AutoTokenizer.from_pretrained(source)
+    try:
+        model = AutoModelForSequenceClassification.from_pretrained(source)
+    except OSError:
+        # EmoRoBERTa is published with TensorFlow weights only
+        model = AutoModelForSequenceClassification.from_pretrained(source, from_tf=True)
+    model.eval()
+
+    os.makedirs(output_dir, exist_ok=True)
+    sample = tokenizer(['export sample'], return_tensors='pt')
+    path = os.path.join(output_dir, 'model.onnx')
+    torch.onnx.export(
+        model, (sample['input_ids'], sample['attention_mask']), path,
+        input_names=['input_ids', 'attention_mask'], output_names=['logits'],
+        dynamic_axes={
+            'input_ids': {0: 'batch', 1: 'sequence'},
+            'attention_mask': {0: 'batch', 1: 'sequence'},
+            'logits': {0: 'batch'}
+        },
+        opset_version=14
+    )
+    tokenizer.save_pretrained(output_dir)
+    model.config.save_pretrained(output_dir)
+    return path
+
+
+def quantize_model(output_dir):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    path = os.path.join(output_dir, 'model.int8.onnx')
+    quantize_dynamic(os.path.join(output_dir, 'model.onnx'), path, weight_type=QuantType.QInt8)
+    return path
+
+
+def prepare_model(model_id, quantize=True, root=ONNX_DIR):
+    output_dir = model_dir(model_id, root)
+    name = 'model.int8.onnx' if quantize else 'model.onnx'
+    if not os.path.exists(os.path.join(output_dir, 'model.onnx')):
+        export_model(model_id, output_dir)
+    if quantize and not os.path.exists(os.path.join(output_dir, name)):
+        quantize_model(output_dir)
+    return output_dir, name
+
+
+class OnnxClassifier:
+    # Mirrors the call signature and output shape of a transformers
+    # text-classification pipeline so it can be swapped in behind get_model()
+    def __init__(self, output_dir, name='model.int8.onnx', intra_op_threads=INTRA_OP_THREADS,
+                 inter_op_threads=INTER_OP_THREADS, max_length=MAX_LENGTH):
+        import onnxruntime as ort
+        from transformers import AutoConfig, AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(output_dir)
+        config = AutoConfig.from_pretrained(output_dir)
+        self.id2label = {int(i): label for i, label in config.id2label.items()}
+        self.sigmoid = config.problem_type == 'multi_label_classification' or config.num_labels == 1
+        self.max_length = max_length
+
+        path = os.path.join(output_dir, name)
+        self.size_mb = os.path.getsize(path) / 2 ** 20
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+    def scores(self, texts, truncation=True):
+        encoded = self.tokenizer(
+            texts, padding=True, truncation=truncation, max_length=self.max_length, return_tensors='np'
+        )
+        logits = self.session.run(['logits'], {
+            'input_ids': encoded['input_ids'].astype(np.int64),
+            'attention_mask': encoded['attention_mask'].astype(np.int64)
+        })[0]
+        if self.sigmoid:
+            return 1 / (1 + np.exp(-logits))
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def __call__(self, texts, batch_size=None, truncation=True, top_k=_TOP_ONE, **kwargs):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        batch_size = batch_size or len(texts) or 1
+
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            for row in self.scores(texts[start:start + batch_size], truncation):
+                ranked = [{'label': self.id2label[int(i)], 'score': float(row[i])} for i in np.argsort(-row)]
+                if top_k is _TOP_ONE:
+                    outputs.append(ranked[0])
+                else:
+                    outputs.append(ranked if top_k is None else ranked[:top_k])
+
+        if single:
+            return outputs[0] if isinstance(outputs[0], list) else outputs
+        return outputs
+
+
+def load_onnx_classifier(model_id, quantize=True):
+    output_dir, name = prepare_model(model_id, quantize)
+    return OnnxClassifier(output_dir, name)
+
+
+def top_labels(classifier, texts, batch_size=32):
+    start = time.perf_counter()
+    outputs = classifier(texts, batch_size=batch_size, truncation=True)
+    return [output['label'] for output in outputs], time.perf_counter() - start
+
+
+def check_parity(reference, candidate, texts, batch_size=32):
+    reference_labels, reference_seconds = top_labels(reference, texts, batch_size)
+    candidate_labels, candidate_seconds = top_labels(candidate, texts, batch_size)
+    mismatches = [(text, expected, actual)
+                  for text, expected, actual in zip(texts, reference_labels, candidate_labels) if expected != actual]
+    return {
+        'texts': len(texts),
+        'agreement': 1 - len(mismatches) / len(texts) if texts else 1.0,
+        'mismatches': mismatches,
+        'reference_seconds': reference_seconds,
+        'candidate_seconds': candidate_seconds,
+        'speedup': reference_seconds / candidate_seconds if candidate_seconds else float('inf')
+    }
+
+
+def main(argv=None):
+    from models import EMOTION_MODEL
+
+    parser = argparse.ArgumentParser(description="Export a model to quantized ONNX and compare it with the PyTorch pipeline")
+    parser.add_argument('--model', default=EMOTION_MODEL)
+    parser.add_argument('--fixtures', default=FIXTURES)
+    parser.add_argument('--no-quantize', action='store_true')
+    parser.add_argument('--min-agreement', type=float, default=0.98)
+    args = parser.parse_args(argv)
+
+    from transformers import pipeline
+
+    with open(args.fixtures, encoding='utf-8') as f:
+        texts = [line.strip() for line in f if line.strip()]
+    reference = pipeline('sentiment-analysis', model=args.model)
+    candidate = load_onnx_classifier(args.model, quantize=not args.no_quantize)
+    report = check_parity(reference, candidate, texts)
+
+    print(f"{report['texts']} texts, agreement {report['agreement']:.1%}, "
+          f"torch {report['reference_seconds']:.2f}s, onnx {report['candidate_seconds']:.2f}s, "
+          f"speedup {report['speedup']:.2f}x")
+    for text, expected, actual in report['mismatches']:
+        print(f"  {expected} -> {actual}: {text}")
+    return 0 if report['agreement'] >= args.min_agreement else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
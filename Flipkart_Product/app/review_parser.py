@@ -0,0 +1,98 @@
+import re
+import sys
+import time
+import tracemalloc
+from typing import NamedTuple, Optional
+
+from lxml import etree, html
+
+# Flipkart class names in one place; when the markup changes only this
+# mapping needs updating
+SELECTORS = {
+    'card': '_2wzgFH',
+    'name': '_2sc7ZR',
+    'title': '_2-N8zT',
+    'comment': 't-ZTKy',
+}
+
+COLUMNS = ['Customer Name', 'Review Title', 'Rating', 'Comment']
+
+
+class Review(NamedTuple):
+    customer_name: str
+    title: str
+    rating: Optional[int]
+    comment: str
+
+
+def _has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def compile_selectors(selectors):
+    return {
+        'card': etree.XPath(f"//div[{_has_class(selectors['card'])}]"),
+        'name': etree.XPath(f"string(.//p[{_has_class(selectors['name'])}][1])"),
+        'title': etree.XPath(f"string(.//p[{_has_class(selectors['title'])}][1])"),
+        # The star badge is the first div of the card's first row
+        'rating': etree.XPath("string(div[1]/div[1])"),
+        'comment': etree.XPath(f"string(.//div[{_has_class(selectors['comment'])}][1]/div/div[1])"),
+    }
+
+
+_XPATHS = compile_selectors(SELECTORS)
+_RATING = re.compile(r'\d+')
+
+
+def _clean(text):
+    return ' '.join(text.split())
+
+
+def parse_rating(text):
+    # Flipkart ratings are 1-5 stars; anything else (a stray number in an
+    # uploaded CSV, say) is treated as missing rather than stored
+    match = _RATING.search(text)
+    rating = int(match.group()) if match else None
+    return rating if rating is not None and 1 <= rating <= 5 else None
+
+
+def parse_page(content, xpaths=_XPATHS):
+    if not content or not content.strip():
+        return []
+    root = html.fromstring(content)
+
+    # Each card yields one record, so a field missing from one review can
+    # no longer shift the other columns out of line
+    reviews = []
+    for card in xpaths['card'](root):
+        review = Review(
+            _clean(xpaths['name'](card)),
+            _clean(xpaths['title'](card)),
+            parse_rating(xpaths['rating'](card)),
+            _clean(xpaths['comment'](card))
+        )
+        if review.title or review.comment:
+            reviews.append(review)
+    return reviews
+
+
+def benchmark(paths, repeat=20):
+    for path in paths:
+        with open(path, 'rb') as f:
+            content = f.read()
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            reviews = parse_page(content)
+        per_page = (time.perf_counter() - start) / repeat
+
+        tracemalloc.start()
+        parse_page(content)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f"{path}: {len(reviews)} reviews, {per_page * 1000:.2f} ms/page, peak {peak / 1024:.0f} KiB")
+
+
+if __name__ == '__main__':
+    benchmark(sys.argv[1:])
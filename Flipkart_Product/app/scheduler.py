@@ -0,0 +1,352 @@
+import argparse
+import asyncio
+import csv
+import heapq
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+from aggregates import get_aggregates
+from cache import get_cache
+from fetcher import RATE_PER_HOST
+from incremental import MAX_PAGES, get_state, iter_page_reviews, most_recent_first, new_scrape_stats
+from inference import DEFAULT_BATCH_SIZE, classify_cached
+from metrics import incr, observe
+from models import EMOTION_MODEL, cache_model_id
+from review_parser import COLUMNS
+from store import ReviewStore
+from workers import get_classifier
+
+SCHEDULER_PATH = os.environ.get('SCHEDULER_PATH', 'scheduler.sqlite3')
+SCHEDULER_WORKERS = int(os.environ.get('SCHEDULER_WORKERS', 4))
+REQUESTS_PER_SECOND = float(os.environ.get('SCHEDULER_RPS', RATE_PER_HOST))
+DEFAULT_INTERVAL = float(os.environ.get('SCHEDULER_DEFAULT_INTERVAL', 6 * 3600))
+RETRY_DELAY = float(os.environ.get('SCHEDULER_RETRY_DELAY', 300))
+# A claim older than this is taken to belong to a process that died
+CLAIM_TIMEOUT = float(os.environ.get('SCHEDULER_CLAIM_TIMEOUT', 3600))
+TICK_SECONDS = 1.0
+
+PRODUCT_FIELDS = ['name', 'url', 'interval', 'priority', 'enabled', 'next_run', 'last_run', 'last_status',
+                  'last_error', 'last_seconds', 'last_new_reviews', 'failures', 'runs', 'running_since']
+
+# Fast tokenizers and pipelines are not safe to call from several threads
+# at once; scrape jobs overlap on the network and take turns on the model
+_classify_lock = threading.Lock()
+
+
+def scrape_and_classify(name, url, limiter=None, max_pages=MAX_PAGES, batch_size=DEFAULT_BATCH_SIZE):
+    # One monitoring job: fetch only reviews newer than the last run, classify
+    # them, then append to the CSV, the review store and the rolling counts
+    state = get_state()
+    url = most_recent_first(url)
+    stats = new_scrape_stats()
+    reviews, fingerprints = [], []
+    page_urls = (url.format(i) for i in range(1, max_pages + 1))
+    for page_reviews, page_fingerprints in iter_page_reviews(page_urls, name, state, stats=stats, limiter=limiter):
+        reviews.extend(page_reviews)
+        fingerprints.extend(page_fingerprints)
+
+    predictions = None
+    if reviews:
+        with _classify_lock:
+            predictions, _ = classify_cached(
+                get_classifier('emotion'), cache_model_id(EMOTION_MODEL), [review.comment for review in reviews], get_cache(), batch_size
+            )
+        writer = ReviewStore().writer(name)
+        writer.add(reviews, predictions, fingerprints)
+        writer.close()
+        get_aggregates().add(name, [prediction['label'] for prediction in predictions])
+        filename = f'{name}_reviews.csv'
+        pd.DataFrame(reviews, columns=COLUMNS).to_csv(filename, mode='a', index=False, header=not os.path.exists(filename))
+    state.mark_seen(name, fingerprints, stats['pages'])
+    return {'pages': stats['pages'], 'failed_pages': stats['failed_pages'], 'new_reviews': len(reviews), 'stop': stats['stop']}
+
+
+class DatabaseRateLimiter:
+    # The requests-per-second budget kept in the scheduler database, so every
+    # process scheduling against it (a daemon, the dashboard's "run now")
+    # draws from one budget. Each request reserves the next slot of a
+    # generic cell rate schedule in one IMMEDIATE transaction and sleeps
+    # until its slot comes up
+    def __init__(self, path=SCHEDULER_PATH, rate=REQUESTS_PER_SECOND, burst=1):
+        self.interval = 1.0 / rate
+        self.tolerance = (max(1, burst) - 1) * self.interval
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS rate_budget (name TEXT PRIMARY KEY, tat REAL)')
+
+    def reserve(self):
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                row = self.conn.execute("SELECT tat FROM rate_budget WHERE name = 'requests'").fetchone()
+                tat = max(row[0] if row else now, now)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO rate_budget VALUES ('requests', ?)", (tat + self.interval,)
+                )
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+        return max(0.0, tat - self.tolerance - now)
+
+    async def acquire(self, url):
+        delay = await asyncio.to_thread(self.reserve)
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class Scheduler:
+    # Products live in SQLite with their next due time, so the schedule
+    # survives restarts. Due products wait in a priority queue (highest
+    # priority, then most overdue) for a slot on a bounded thread pool, and
+    # every job draws pages from one shared requests-per-second budget.
+    # Jobs are claimed in the database, so several schedulers on the same
+    # file never run one product twice at once
+    def __init__(self, path=SCHEDULER_PATH, workers=SCHEDULER_WORKERS, rps=REQUESTS_PER_SECOND, job=scrape_and_classify):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS products ('
+            'name TEXT PRIMARY KEY, url TEXT, interval REAL, priority INTEGER, enabled INTEGER, next_run REAL, '
+            'last_run REAL, last_status TEXT, last_error TEXT, last_seconds REAL, last_new_reviews INTEGER, '
+            'failures INTEGER, runs INTEGER, running_since REAL)'
+        )
+        self.conn.commit()
+        self.workers = max(1, workers)
+        self.limiter = DatabaseRateLimiter(path, rps, burst=max(1, int(rps)))
+        self.job = job
+        self.ready = []
+        self.queued = set()
+        self.running = set()
+        self.executor = None
+        self.stopping = threading.Event()
+
+    def add_product(self, name, url, interval=DEFAULT_INTERVAL, priority=0, enabled=True):
+        # Re-adding a product updates its settings but keeps its schedule
+        if '{}' not in url:
+            url += ('&' if '?' in url else '?') + 'page={}'
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO products (name, url, interval, priority, enabled, next_run, failures, runs) '
+                'VALUES (?, ?, ?, ?, ?, ?, 0, 0) '
+                'ON CONFLICT (name) DO UPDATE SET url = excluded.url, interval = excluded.interval, '
+                'priority = excluded.priority, enabled = excluded.enabled',
+                (name, url, interval, priority, int(enabled), time.time())
+            )
+            self.conn.commit()
+
+    def remove_product(self, name):
+        with self.lock:
+            self.conn.execute('DELETE FROM products WHERE name = ?', (name,))
+            self.conn.commit()
+
+    def load_products(self, path):
+        # CSV (name,url[,interval][,priority]) or a JSON list of such objects
+        with open(path, encoding='utf-8') as f:
+            rows = json.load(f) if path.endswith('.json') else list(csv.DictReader(f))
+        for row in rows:
+            self.add_product(
+                row['name'], row['url'],
+                float(row.get('interval') or DEFAULT_INTERVAL), int(row.get('priority') or 0)
+            )
+        return len(rows)
+
+    def products(self):
+        with self.lock:
+            rows = self.conn.execute(f"SELECT {', '.join(PRODUCT_FIELDS)} FROM products ORDER BY priority DESC, name").fetchall()
+        return [dict(zip(PRODUCT_FIELDS, row)) for row in rows]
+
+    def enqueue_due(self, now=None):
+        now = time.time() if now is None else now
+        self.release_stale(now)
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT name, url, priority, next_run FROM products '
+                'WHERE enabled AND next_run <= ? AND running_since IS NULL', (now,)
+            ).fetchall()
+            for name, url, priority, next_run in rows:
+                if name not in self.queued and name not in self.running:
+                    heapq.heappush(self.ready, (-priority, next_run, name, url))
+                    self.queued.add(name)
+            return len(self.ready)
+
+    def dispatch(self):
+        started = []
+        with self.lock:
+            while self.ready and len(self.running) < self.workers:
+                _, next_run, name, url = heapq.heappop(self.ready)
+                self.queued.discard(name)
+                now = time.time()
+                # Only one scheduler wins the claim; the others drop the product
+                claimed = self.conn.execute(
+                    'UPDATE products SET running_since = ? '
+                    'WHERE name = ? AND enabled AND next_run <= ? AND running_since IS NULL', (now, name, now)
+                ).rowcount
+                self.conn.commit()
+                if not claimed:
+                    continue
+                self.running.add(name)
+                observe('schedule_lag', max(0.0, now - next_run))
+                started.append((name, url))
+            self.conn.commit()
+        return [(name, self.executor.submit(self.run_job, name, url)) for name, url in started]
+
+    def run_job(self, name, url):
+        start = time.perf_counter()
+        try:
+            result = self.job(name, url, self.limiter)
+            error = None
+        except Exception as exc:
+            result, error = {}, f'{type(exc).__name__}: {exc}'
+        seconds = time.perf_counter() - start
+        self.finish(name, result, error, seconds)
+        return result
+
+    def finish(self, name, result, error, seconds):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute('SELECT interval, failures FROM products WHERE name = ?', (name,)).fetchone()
+            if row is not None:
+                interval, failures = row
+                failures = failures + 1 if error else 0
+                # Failed products retry sooner, backing off up to their interval
+                delay = min(interval, RETRY_DELAY * 2 ** (failures - 1)) if error else interval
+                self.conn.execute(
+                    'UPDATE products SET next_run = ?, last_run = ?, last_status = ?, last_error = ?, last_seconds = ?, '
+                    'last_new_reviews = ?, failures = ?, runs = runs + 1, running_since = NULL WHERE name = ?',
+                    (now + delay, now, 'error' if error else 'ok', error, seconds,
+                     result.get('new_reviews'), failures, name)
+                )
+                self.conn.commit()
+            self.running.discard(name)
+        incr('scheduler_jobs')
+        if error:
+            incr('scheduler_failures')
+        observe('job', seconds)
+
+    def status(self, now=None):
+        # Readable from another process (e.g. the dashboard) straight from the
+        # database: queue depth is how many products are due but not running,
+        # lag is how long they have been waiting past their due time
+        now = time.time() if now is None else now
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT next_run, running_since FROM products WHERE enabled'
+            ).fetchall()
+        waiting = [now - next_run for next_run, running_since in rows if running_since is None and next_run <= now]
+        return {
+            'products': len(rows),
+            'running': sum(1 for _, running_since in rows if running_since is not None),
+            'queue_depth': len(waiting),
+            'max_lag_seconds': round(max(waiting), 1) if waiting else 0.0,
+            'mean_lag_seconds': round(sum(waiting) / len(waiting), 1) if waiting else 0.0,
+            'next_due_in_seconds': round(min((next_run - now for next_run, _ in rows if next_run > now), default=0.0), 1)
+        }
+
+    def release_stale(self, now=None):
+        # Claims left by a process that died mid-job make the product due
+        # again once they time out; live claims of other schedulers stay
+        now = time.time() if now is None else now
+        with self.lock:
+            released = self.conn.execute(
+                'UPDATE products SET running_since = NULL WHERE running_since < ?', (now - CLAIM_TIMEOUT,)
+            ).rowcount
+            self.conn.commit()
+        return released
+
+    def start(self):
+        self.release_stale()
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='scrape')
+        return self
+
+    def run_pending(self):
+        # Runs everything that is due now to completion, then returns
+        if self.executor is None:
+            self.start()
+        self.enqueue_due()
+        futures = []
+        while True:
+            futures = [future for future in futures if not future.done()]
+            futures += [future for _, future in self.dispatch()]
+            if not futures:
+                return self.status()
+            wait(futures, return_when=FIRST_COMPLETED)
+
+    def run_forever(self, report_seconds=60, report=None):
+        if self.executor is None:
+            self.start()
+        last_report = 0.0
+        while not self.stopping.is_set():
+            self.enqueue_due()
+            self.dispatch()
+            if report and time.time() - last_report >= report_seconds:
+                report(self.status())
+                last_report = time.time()
+            self.stopping.wait(TICK_SECONDS)
+
+    def stop(self):
+        self.stopping.set()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep many products' reviews fresh on a schedule")
+    parser.add_argument('--products', help="CSV or JSON file of products to register (name, url, interval, priority)")
+    parser.add_argument('--add', nargs='+', default=[], metavar='NAME=URL', help="register products from the command line")
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, help="refresh interval in seconds for --add")
+    parser.add_argument('--priority', type=int, default=0, help="priority for --add (higher runs first)")
+    parser.add_argument('--remove', nargs='+', default=[], metavar='NAME')
+    parser.add_argument('--workers', type=int, default=SCHEDULER_WORKERS)
+    parser.add_argument('--rps', type=float, default=REQUESTS_PER_SECOND, help="page requests per second across all jobs")
+    parser.add_argument('--state', default=SCHEDULER_PATH)
+    parser.add_argument('--list', action='store_true', help="print the registry and queue status, then exit")
+    parser.add_argument('--once', action='store_true', help="run the products that are due now, then exit")
+    args = parser.parse_args(argv)
+
+    scheduler = Scheduler(args.state, args.workers, args.rps)
+    if args.products:
+        scheduler.load_products(args.products)
+    for value in args.add:
+        name, _, url = value.partition('=')
+        scheduler.add_product(name, url, args.interval, args.priority)
+    for name in args.remove:
+        scheduler.remove_product(name)
+
+    if args.list:
+        print(json.dumps({'status': scheduler.status(), 'products': scheduler.products()}, indent=2))
+        return 0
+    if args.once:
+        print(json.dumps(scheduler.run_pending(), indent=2))
+        scheduler.stop()
+        return 0
+
+    try:
+        scheduler.run_forever(report=lambda status: print(json.dumps(status), flush=True))
+    except KeyboardInterrupt:
+        scheduler.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
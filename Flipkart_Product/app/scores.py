@@ -0,0 +1,115 @@
+import numpy as np
+import pyarrow as pa
+
+from emotions import CATEGORIES, EMOTION_LABELS, LABEL_CATEGORY
+
+SCORE_TYPE = pa.list_(pa.float16(), len(EMOTION_LABELS))
+
+
+def score_vectors(predictions, labels=EMOTION_LABELS):
+    # Full score dicts -> (n, labels) float16 matrix; rows without scores are NaN
+    index = {label: i for i, label in enumerate(labels)}
+    matrix = np.full((len(predictions), len(labels)), np.nan, dtype=np.float16)
+    for row, prediction in enumerate(predictions):
+        scores = (prediction or {}).get('scores')
+        if scores:
+            matrix[row] = 0
+            for label, score in scores.items():
+                if label in index:
+                    matrix[row, index[label]] = score
+    return matrix
+
+
+def category_matrix(mapping=LABEL_CATEGORY, labels=EMOTION_LABELS, categories=CATEGORIES):
+    # One-hot (labels x categories) matrix for a label -> category mapping
+    columns = {category: i for i, category in enumerate(categories)}
+    matrix = np.zeros((len(labels), len(categories)), dtype=np.float32)
+    for i, label in enumerate(labels):
+        matrix[i, columns[mapping.get(label, 'Neutral')]] = 1
+    return matrix
+
+
+class ScoreMatrix:
+    # Every label's score for every review as one float16 array (56 bytes a
+    # review), so rankings, thresholds and category rules can be recomputed
+    # without running the model again
+    def __init__(self, scores, review_ids=None, labels=EMOTION_LABELS):
+        self.scores = np.asarray(scores, dtype=np.float16).reshape(-1, len(labels))
+        self.review_ids = list(review_ids) if review_ids is not None else [None] * len(self.scores)
+        self.labels = np.array(labels, dtype=object)
+
+    @classmethod
+    def from_predictions(cls, predictions, review_ids=None, labels=EMOTION_LABELS):
+        return cls(score_vectors(predictions, labels), review_ids, labels)
+
+    @classmethod
+    def from_arrow(cls, column, review_ids=None, labels=EMOTION_LABELS):
+        # A FixedSizeList<float16> column; null rows come back as NaN
+        column = column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column
+        scores = np.full((len(column), len(labels)), np.nan, dtype=np.float16)
+        valid = ~np.asarray(column.is_null())
+        if valid.any():
+            scores[valid] = column.drop_null().flatten().to_numpy(zero_copy_only=False).reshape(-1, len(labels))
+        return cls(scores, review_ids, labels)
+
+    def to_arrow(self):
+        valid = self.valid()
+        flat = np.nan_to_num(self.scores).reshape(-1)
+        return pa.FixedSizeListArray.from_arrays(pa.array(flat, pa.float16()), len(self.labels), mask=pa.array(~valid))
+
+    def __len__(self):
+        return len(self.scores)
+
+    @property
+    def nbytes(self):
+        return self.scores.nbytes
+
+    def valid(self):
+        return ~np.isnan(self.scores).any(axis=1)
+
+    def top_k(self, k=1):
+        # (indices, scores) of the k best labels per review, best first
+        k = min(k, self.scores.shape[1])
+        scores = np.nan_to_num(self.scores, nan=-1).astype(np.float32)
+        indices = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, indices, axis=1), axis=1, kind='stable')
+        indices = np.take_along_axis(indices, order, axis=1)
+        return indices, np.take_along_axis(scores, indices, axis=1)
+
+    def top_labels(self, k=1):
+        # Rows without scores get None
+        indices, _ = self.top_k(k)
+        labels = self.labels[indices]
+        labels[~self.valid()] = None
+        return labels
+
+    def multi_label(self, threshold=0.3):
+        # Boolean (reviews x labels) mask of every label scoring >= threshold
+        return np.nan_to_num(self.scores, nan=0) >= threshold
+
+    def label_counts(self, threshold=None):
+        # Top-1 label counts, or with a threshold, how many reviews carry each label
+        valid = self.valid()
+        if threshold is None:
+            counts = np.bincount(self.top_k(1)[0][valid, 0], minlength=len(self.labels))
+        else:
+            counts = self.multi_label(threshold)[valid].sum(axis=0)
+        return [{'Emotion': label, 'Count': int(count)}
+                for label, count in sorted(zip(self.labels, counts), key=lambda item: -item[1]) if count]
+
+    def categories(self, mapping=LABEL_CATEGORY, categories=CATEGORIES, rule='top'):
+        # Category per review under any label -> category mapping. rule='top'
+        # maps the best label; rule='mass' picks the category with the
+        # largest summed score
+        onehot = category_matrix(mapping, list(self.labels), categories)
+        if rule == 'mass':
+            codes = (np.nan_to_num(self.scores).astype(np.float32) @ onehot).argmax(axis=1)
+        else:
+            codes = onehot.argmax(axis=1)[self.top_k(1)[0][:, 0]]
+        return np.array(categories, dtype=object)[codes]
+
+    def category_counts(self, mapping=LABEL_CATEGORY, categories=CATEGORIES, rule='top'):
+        codes = self.categories(mapping, categories, rule)[self.valid()]
+        names, counts = np.unique(codes.astype(str), return_counts=True) if len(codes) else ([], [])
+        return [{'Emotion Category': str(name), 'Count': int(count)}
+                for name, count in sorted(zip(names, counts), key=lambda item: -item[1])]
@@ -1,76 +1,38 @@
-import requests
-from bs4 import BeautifulSoup
+from fetcher import fetch_pages
+from scheduler import Scheduler
+from review_parser import COLUMNS, parse_page
 import pandas as pd
 
-# User-Agent and Accept-Language headers
-headers = {
-    'User-Agent': 'Your_User_Agent_Here',
-    'Accept-Language': 'en-us,en;q=0.5'
-}
-
 def scrape_reviews_and_save_to_csv(url, product_name):
-    customer_names = []
-    review_title = []
-    ratings = []
-    comments = []
-
-    for i in range(1, 44):
-        # Construct the URL for the current page
-        current_url = f"{url}&page={i}"
-
-        # Send a GET request to the page
-        page = requests.get(current_url, headers=headers)
-
-        # Parse the HTML content
-        soup = BeautifulSoup(page.content, 'html.parser')
-
-        # Extract customer names
-        names = soup.find_all('p', class_='_2sc7ZR')
-        for name in names:
-            customer_names.append(name.get_text(strip=True))
+    # Fetch all pages concurrently; they come back in page order
+    pages, fetch_stats = fetch_pages((f"{url}&page={i}" for i in range(1, 44)), product=product_name)
 
-        # Extract review titles
-        titles = soup.find_all('p', class_='_2-N8zT')
-        for title in titles:
-            review_title.append(title.get_text(strip=True))
-
-        # Extract ratings
-        ratings_all = soup.find_all('div', class_='col _2wzgFH K0kLPL')
-        for rating in ratings_all:
-            ratings.append(rating.div.text.strip())
-
-        # Extract comments
-        comments_all = soup.find_all('div', class_='t-ZTKy')
-        for comment in comments_all:
-            comment_text = comment.div.div.get_text(strip=True)
-            comments.append(comment_text)
-
-    # Ensure all lists have the same length
-    min_length = min(len(customer_names), len(review_title), len(ratings), len(comments))
-    customer_names = customer_names[:min_length]
-    review_title = review_title[:min_length]
-    ratings = ratings[:min_length]
-    comments = comments[:min_length]
+    # Parse every review card once into one record per review
+    reviews = []
+    for content in pages:
+        if content is not None:
+            reviews.extend(parse_page(content))
 
     # Create a DataFrame from the collected data
-    data = {
-        'Customer Name': customer_names,
-        'Review Title': review_title,
-        'Rating': ratings,
-        'Comment': comments
-    }
-
-    df = pd.DataFrame(data)
+    df = pd.DataFrame(reviews, columns=COLUMNS)
 
     # Save the DataFrame to a CSV file
     df.to_csv(f'{product_name}_reviews.csv', index=False)
 
-# URLs for scraping reviews
+# URLs for scraping reviews; these seed the monitoring schedule, which can
+# hold any number of products (see scheduler.py --add / --products)
 badminton_url = "https://www.flipkart.com/yonex-mavis-350-nylon-shuttle-yellow/product-reviews/itmfcjdyhnghfyey?pid=STLEFJ7UFQGRUUR3&lid=LSTSTLEFJ7UFQGRUUR3SUDA2S&marketplace=FLIPKART"
 motorola_url = "https://www.flipkart.com/motorola-g84-5g-viva-magneta-256-gb/product-reviews/itmed938e33ffdf5?pid=MOBGQFX672GDDQAQ&lid=LSTMOBGQFX672GDDQAQSSIAM2&marketplace=FLIPKART"
 
-# Scrape and save reviews for badminton
-scrape_reviews_and_save_to_csv(badminton_url, 'badminton')
-
-# Scrape and save reviews for Motorola
-scrape_reviews_and_save_to_csv(motorola_url, 'motorola')
+SEED_PRODUCTS = {'badminton': badminton_url, 'motorola': motorola_url}
+
+if __name__ == "__main__":
+    # Register the seed products once, then scrape whatever is due in
+    # parallel under the scheduler's shared request budget
+    scheduler = Scheduler()
+    registered = {product['name'] for product in scheduler.products()}
+    for name, url in SEED_PRODUCTS.items():
+        if name not in registered:
+            scheduler.add_product(name, url)
+    print(scheduler.run_pending())
+    scheduler.stop()
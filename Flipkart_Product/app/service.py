@@ -0,0 +1,226 @@
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cache import get_cache
+from inference import classify_cached
+from models import EMOTION_MODEL, SENTIMENT_MODEL, cache_model_id
+from workers import get_classifier
+
+MAX_BATCH_SIZE = 32
+MAX_WAIT_MS = 10
+MAX_QUEUE = 1024
+REQUEST_TIMEOUT = 30
+
+
+class QueueFull(Exception):
+    pass
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class MicroBatcher:
+    # Collects single-text requests from many clients and classifies them
+    # together, flushing when the batch is full or the oldest request has
+    # waited max_wait_ms
+    def __init__(self, name, model_id, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS,
+                 max_queue=MAX_QUEUE, cache=None):
+        self.name = name
+        self.model_id = model_id
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.cache = cache
+        self.requests = queue.Queue(max_queue)
+        self.classifier = None
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=10000)
+        self.batch_sizes = deque(maxlen=10000)
+        self.served = 0
+        self.rejected = 0
+        self.errors = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.classifier = get_classifier(self.name)
+        self.thread.start()
+        return self
+
+    def submit(self, texts):
+        # A request's texts are queued together or not at all, so a request
+        # bigger than the free space never leaves orphaned work behind. Only
+        # this thread-safe section adds to the queue, so the space checked
+        # cannot shrink before the puts
+        with self.lock:
+            if self.requests.maxsize and self.requests.qsize() + len(texts) > self.requests.maxsize:
+                self.rejected += len(texts)
+                raise QueueFull(f"{self.name} queue is full")
+            submitted = time.perf_counter()
+            futures = [Future() for _ in texts]
+            for text, future in zip(texts, futures):
+                self.requests.put_nowait((text, submitted, future))
+        return futures
+
+    def next_batch(self):
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            try:
+                # Texts from unrelated clients share a batch, so none of them
+                # may take its label from another's text
+                predictions, _ = classify_cached(
+                    self.classifier, self.model_id, [text for text, _, _ in batch], self.cache, self.max_batch_size,
+                    dedup=False
+                )
+            except Exception as error:
+                with self.lock:
+                    self.errors += len(batch)
+                for _, _, future in batch:
+                    future.set_exception(error)
+                continue
+
+            now = time.perf_counter()
+            with self.lock:
+                self.batch_sizes.append(len(batch))
+                self.served += len(batch)
+                self.latencies.extend(now - submitted for _, submitted, _ in batch)
+            for (_, _, future), prediction in zip(batch, predictions):
+                future.set_result(prediction)
+
+    def metrics(self):
+        with self.lock:
+            latencies = list(self.latencies)
+            batch_sizes = list(self.batch_sizes)
+            served, rejected, errors = self.served, self.rejected, self.errors
+        mean_batch = sum(batch_sizes) / len(batch_sizes) if batch_sizes else 0.0
+        return {
+            'served': served,
+            'rejected': rejected,
+            'errors': errors,
+            'queue_depth': self.requests.qsize(),
+            'batches': len(batch_sizes),
+            'mean_batch_size': round(mean_batch, 2),
+            'batch_fill': round(mean_batch / self.max_batch_size, 3),
+            'latency_ms': {
+                name: round(value * 1000, 2) if value is not None else None
+                for name, value in (('p50', percentile(latencies, 0.5)),
+                                    ('p90', percentile(latencies, 0.9)),
+                                    ('p99', percentile(latencies, 0.99)))
+            }
+        }
+
+
+class Handler(BaseHTTPRequestHandler):
+    batchers = {}
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok', 'models': sorted(self.batchers)})
+        elif self.path == '/metrics':
+            self.send_json(200, {name: batcher.metrics() for name, batcher in self.batchers.items()})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        batcher = self.batchers.get(self.path.strip('/'))
+        if batcher is None:
+            self.send_json(404, {'error': 'not found'})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            texts = payload['texts'] if 'texts' in payload else [payload['text']]
+        except (ValueError, KeyError, TypeError):
+            texts = None
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            self.send_json(400, {'error': "expected JSON with a string 'text' or a list of strings 'texts'"})
+            return
+        if batcher.requests.maxsize and len(texts) > batcher.requests.maxsize:
+            self.send_json(413, {'error': f"at most {batcher.requests.maxsize} texts per request"})
+            return
+
+        try:
+            futures = batcher.submit(texts)
+            predictions = [future.result(REQUEST_TIMEOUT) for future in futures]
+        except QueueFull as error:
+            self.send_json(503, {'error': str(error)}, {'Retry-After': '1'})
+            return
+        except Exception as error:
+            self.send_json(500, {'error': f'{type(error).__name__}: {error}'})
+            return
+        self.send_json(200, {'predictions': predictions} if 'texts' in payload else predictions[0])
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Server(ThreadingHTTPServer):
+    # Many clients connect at once; the default listen backlog of 5 resets them
+    request_queue_size = 256
+    daemon_threads = True
+
+
+def make_server(host, port, batchers):
+    handler = type('BoundHandler', (Handler,), {'batchers': batchers})
+    return Server((host, port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve emotion and sentiment predictions over HTTP with micro-batching")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8600)
+    parser.add_argument('--max-batch-size', type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument('--max-wait-ms', type=float, default=MAX_WAIT_MS)
+    parser.add_argument('--max-queue', type=int, default=MAX_QUEUE)
+    parser.add_argument('--no-cache', action='store_true')
+    args = parser.parse_args(argv)
+
+    cache = None if args.no_cache else get_cache()
+    batchers = {
+        name: MicroBatcher(
+            name, cache_model_id(model_id), args.max_batch_size, args.max_wait_ms, args.max_queue, cache
+        ).start()
+        for name, model_id in (('emotion', EMOTION_MODEL), ('sentiment', SENTIMENT_MODEL))
+    }
+    server = make_server(args.host, args.port, batchers)
+    print(f"Serving on http://{args.host}:{server.server_port} (POST /emotion, POST /sentiment, GET /metrics)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,136 @@
+import os
+import uuid
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from metrics import span
+from scores import SCORE_TYPE, ScoreMatrix
+from store_paths import STORE_PATH, stored_products
+
+FLUSH_ROWS = int(os.environ.get('REVIEW_STORE_FLUSH_ROWS', 5000))
+
+SCHEMA = pa.schema([
+    ('product', pa.string()),
+    ('scrape_date', pa.string()),
+    ('review_id', pa.string()),
+    ('customer_name', pa.string()),
+    ('title', pa.string()),
+    ('rating', pa.int8()),
+    ('comment', pa.string()),
+    ('label', pa.string()),
+    ('score', pa.float32()),
+    ('scores', SCORE_TYPE),
+    ('scraped_at', pa.timestamp('ms', tz='UTC')),
+])
+
+PARTITIONING = ds.partitioning(
+    pa.schema([('product', pa.string()), ('scrape_date', pa.string())]), flavor='hive'
+)
+
+
+def build_table(product, reviews, predictions=None, review_ids=None, scraped_at=None):
+    scraped_at = scraped_at or datetime.now(timezone.utc)
+    predictions = predictions or [{} for _ in reviews]
+    review_ids = review_ids or [None] * len(reviews)
+    return pa.table({
+        'product': pa.array([product] * len(reviews), pa.string()),
+        'scrape_date': pa.array([scraped_at.strftime('%Y-%m-%d')] * len(reviews), pa.string()),
+        'review_id': pa.array(review_ids, pa.string()),
+        'customer_name': pa.array([review.customer_name for review in reviews], pa.string()),
+        'title': pa.array([review.title for review in reviews], pa.string()),
+        'rating': pa.array([review.rating for review in reviews], pa.int8()),
+        'comment': pa.array([review.comment for review in reviews], pa.string()),
+        'label': pa.array([prediction.get('label') for prediction in predictions], pa.string()),
+        'score': pa.array([prediction.get('score') for prediction in predictions], pa.float32()),
+        'scores': ScoreMatrix.from_predictions(predictions).to_arrow(),
+        'scraped_at': pa.array([scraped_at] * len(reviews), pa.timestamp('ms', tz='UTC')),
+    }, schema=SCHEMA)
+
+
+class ReviewStore:
+    def __init__(self, root=STORE_PATH):
+        self.root = root
+
+    def append(self, table):
+        if table.num_rows == 0:
+            return 0
+        # Every write gets fresh file names, so existing files are never touched
+        ds.write_dataset(
+            table, self.root, format='parquet', partitioning=PARTITIONING,
+            basename_template=f'part-{uuid.uuid4().hex}-{{i}}.parquet',
+            existing_data_behavior='overwrite_or_ignore'
+        )
+        return table.num_rows
+
+    def dataset(self):
+        return ds.dataset(self.root, format='parquet', partitioning=PARTITIONING, schema=SCHEMA)
+
+    def read(self, product=None, columns=None, since=None, until=None, where=None):
+        if not os.path.isdir(self.root):
+            return SCHEMA.empty_table().select(columns) if columns else SCHEMA.empty_table()
+        # Partition filters prune whole directories; the rest is pushed down
+        # to the Parquet row groups along with the column projection
+        conditions = []
+        if product is not None:
+            conditions.append(ds.field('product') == product)
+        if since is not None:
+            conditions.append(ds.field('scrape_date') >= str(since)[:10])
+        if until is not None:
+            conditions.append(ds.field('scrape_date') <= str(until)[:10])
+        if where is not None:
+            conditions.append(where)
+        expression = None
+        for condition in conditions:
+            expression = condition if expression is None else expression & condition
+        return self.dataset().to_table(columns=columns, filter=expression)
+
+    def read_scores(self, product=None, since=None, until=None):
+        # Files written before the scores column existed read back as NaN rows
+        table = self.read(product, columns=['review_id', 'scores'], since=since, until=until)
+        return ScoreMatrix.from_arrow(table.column('scores'), table.column('review_id').to_pylist())
+
+    def products(self):
+        return stored_products(self.root)
+
+    def writer(self, product, flush_rows=FLUSH_ROWS):
+        return StoreWriter(self, product, flush_rows)
+
+
+class StoreWriter:
+    # Buffers streamed batches so the store gets a few large files instead
+    # of one small file per classified batch
+    def __init__(self, store, product, flush_rows=FLUSH_ROWS):
+        self.store = store
+        self.product = product
+        self.flush_rows = flush_rows
+        self.tables = []
+        self.buffered = 0
+        self.written = 0
+        self.committed = []
+
+    def add(self, reviews, predictions=None, review_ids=None, committed=None):
+        # committed, if given, runs once these rows are on disk, so callers
+        # can mark them seen or count them without getting ahead of the store
+        if reviews:
+            self.tables.append(build_table(self.product, reviews, predictions, review_ids))
+            self.buffered += len(reviews)
+        if committed is not None:
+            self.committed.append(committed)
+        if self.buffered >= self.flush_rows or not self.tables:
+            self.flush()
+
+    def flush(self):
+        if self.tables:
+            with span('store'):
+                self.written += self.store.append(pa.concat_tables(self.tables))
+        self.tables = []
+        self.buffered = 0
+        committed, self.committed = self.committed, []
+        for callback in committed:
+            callback()
+
+    def close(self):
+        self.flush()
+        return self.written
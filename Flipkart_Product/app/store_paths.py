@@ -0,0 +1,12 @@
+import os
+from urllib.parse import unquote
+
+# Kept apart from store.py so listing products does not import pyarrow
+STORE_PATH = os.environ.get('REVIEW_STORE_PATH', 'review_store')
+
+
+def stored_products(root=STORE_PATH):
+    # The store is hive-partitioned, so every product is a product=<name> directory
+    if not os.path.isdir(root):
+        return []
+    return sorted(unquote(name.split('=', 1)[1]) for name in os.listdir(root) if name.startswith('product='))
@@ -0,0 +1,128 @@
+import queue
+import threading
+import time
+from collections import deque
+
+from emotions import EmotionTally
+from incremental import iter_page_reviews, new_scrape_stats
+from inference import DEFAULT_BATCH_SIZE, classify_cached
+from metrics import profile_thread
+
+_DONE = object()
+
+
+def background(iterable, maxsize=4):
+    # Runs the iterable on a worker thread so page fetching and parsing overlap
+    # with classification; the bounded queue keeps the producer from racing ahead
+    items = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def run():
+        try:
+            for item in iterable:
+                put(item)
+                if stop.is_set():
+                    return
+        except Exception as error:
+            put(error)
+        finally:
+            put(_DONE)
+
+    threading.Thread(target=profile_thread(run), daemon=True).start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def stream_analysis(page_urls, classifier, model_id, cache=None, product=None, state=None,
+                    batch_size=DEFAULT_BATCH_SIZE, flush_seconds=1.0, keep_rows=200):
+    stats = new_scrape_stats()
+    stats['dedup'] = {}
+    tally = EmotionTally()
+    recent = deque(maxlen=keep_rows)
+    pending, pending_fingerprints = [], []
+    last_flush = time.perf_counter()
+
+    def flush(reviews, fingerprints):
+        predictions, batch_stats = classify_cached(
+            classifier, model_id, [review.comment for review in reviews], cache, batch_size, stats=stats['dedup']
+        )
+        labels = [prediction['label'] for prediction in predictions]
+        tally.update(labels)
+        recent.extend((review.comment, label) for review, label in zip(reviews, labels))
+        return {
+            'reviews': reviews,
+            'fingerprints': fingerprints,
+            'predictions': predictions,
+            'batch_stats': batch_stats,
+            'tally': tally,
+            'recent': recent,
+            'stats': stats,
+            'done': False
+        }
+
+    # Only the current batch and the running aggregates are held, so memory
+    # stays flat however many pages are scraped
+    for page_reviews, page_fingerprints in background(iter_page_reviews(page_urls, product, state, stats=stats)):
+        pending.extend(page_reviews)
+        pending_fingerprints.extend(page_fingerprints)
+        if len(pending) >= batch_size or time.perf_counter() - last_flush >= flush_seconds:
+            while pending:
+                yield flush(pending[:batch_size], pending_fingerprints[:batch_size])
+                pending, pending_fingerprints = pending[batch_size:], pending_fingerprints[batch_size:]
+                if len(pending) < batch_size:
+                    break
+            last_flush = time.perf_counter()
+
+    if pending:
+        yield flush(pending, pending_fingerprints)
+    yield {
+        'reviews': [],
+        'fingerprints': [],
+        'predictions': [],
+        'batch_stats': [],
+        'tally': tally,
+        'recent': recent,
+        'stats': stats,
+        'done': True
+    }
+
+
+def analyze_chunks(chunks, classifier, model_id, cache=None, batch_size=DEFAULT_BATCH_SIZE, keep_rows=200):
+    # Each chunk of texts is classified and folded into the running tally
+    # before the next one is read, so memory does not grow with the input
+    stats = {'rows': 0, 'chunks': 0, 'dedup': {}}
+    tally = EmotionTally()
+    recent = deque(maxlen=keep_rows)
+
+    for texts in chunks:
+        predictions, batch_stats = classify_cached(classifier, model_id, texts, cache, batch_size, stats=stats['dedup'])
+        labels = [prediction['label'] for prediction in predictions]
+        tally.update(labels)
+        recent.extend(zip(texts, labels))
+        stats['rows'] += len(texts)
+        stats['chunks'] += 1
+        yield {
+            'texts': texts,
+            'predictions': predictions,
+            'batch_stats': batch_stats,
+            'tally': tally,
+            'recent': recent,
+            'stats': stats,
+            'done': False
+        }
@@ -0,0 +1,150 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from inference import DEFAULT_BATCH_SIZE, classify_windows
+
+WORKERS = int(os.environ.get('INFERENCE_WORKERS', 1))
+THREADS_PER_WORKER = int(os.environ.get('INFERENCE_THREADS_PER_WORKER', 0))
+
+_worker_model = None
+
+
+def default_threads(workers):
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def _init_worker(model_name, threads):
+    global _worker_model
+    # Thread settings must be in place before torch/onnxruntime start their pools
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    os.environ['ORT_INTRA_OP_THREADS'] = str(threads)
+    os.environ['ORT_INTER_OP_THREADS'] = '1'
+    try:
+        import torch
+        torch.set_num_threads(threads)
+        torch.set_num_interop_threads(1)
+    except ImportError:
+        pass
+
+    from models import get_model
+    _worker_model = get_model(model_name)
+
+
+def _ping():
+    return os.getpid()
+
+
+def _classify_shard(texts, batch_size):
+    predictions, batch_stats = classify_windows(_worker_model, texts, batch_size)
+    for stat in batch_stats:
+        stat['Worker'] = os.getpid()
+    return predictions, batch_stats
+
+
+class WorkerPool:
+    def __init__(self, model_name='emotion', workers=WORKERS, threads_per_worker=THREADS_PER_WORKER):
+        self.workers = max(1, workers)
+        self.threads_per_worker = threads_per_worker or default_threads(self.workers)
+        # spawn keeps torch's threads and locks out of the children
+        self.executor = ProcessPoolExecutor(
+            self.workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker, initargs=(model_name, self.threads_per_worker)
+        )
+
+    def warm_up(self):
+        # Starting every worker loads its model copy up front instead of on
+        # the first real request
+        return sorted({future.result() for future in [self.executor.submit(_ping) for _ in range(self.workers)]})
+
+    def classify_texts(self, texts, batch_size=DEFAULT_BATCH_SIZE):
+        texts = [str(text) for text in texts]
+        if not texts:
+            return [], []
+
+        # Shards are cut from a length-sorted order so each worker pads only
+        # against similarly sized reviews; results are put back by index
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        shard_size = max(batch_size, -(-len(texts) // (self.workers * 4)))
+        shards = [order[i:i + shard_size] for i in range(0, len(order), shard_size)]
+        futures = [self.executor.submit(_classify_shard, [texts[i] for i in shard], batch_size) for shard in shards]
+
+        predictions = [None] * len(texts)
+        batch_stats = []
+        for shard, future in zip(shards, futures):
+            shard_predictions, shard_stats = future.result()
+            for i, prediction in zip(shard, shard_predictions):
+                predictions[i] = prediction
+            batch_stats.extend(shard_stats)
+        for number, stat in enumerate(batch_stats, 1):
+            stat['Batch'] = number
+        return predictions, batch_stats
+
+    def close(self):
+        self.executor.shutdown()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(model_name, workers=WORKERS):
+    with _pools_lock:
+        if model_name not in _pools:
+            _pools[model_name] = WorkerPool(model_name, workers)
+        return _pools[model_name]
+
+
+def get_classifier(model_name):
+    if WORKERS > 1:
+        return get_pool(model_name)
+    from models import get_model
+    return get_model(model_name)
+
+
+def scaling_report(texts, worker_counts, model_name='emotion', batch_size=DEFAULT_BATCH_SIZE):
+    report = []
+    for workers in worker_counts:
+        pool = WorkerPool(model_name, workers)
+        try:
+            pool.warm_up()
+            start = time.perf_counter()
+            pool.classify_texts(texts, batch_size)
+            seconds = time.perf_counter() - start
+        finally:
+            pool.close()
+        report.append({
+            'workers': workers,
+            'threads_per_worker': pool.threads_per_worker,
+            'seconds': round(seconds, 3),
+            'reviews_per_sec': round(len(texts) / seconds, 1),
+            'speedup': round(report[0]['seconds'] / seconds, 2) if report else 1.0
+        })
+    return report
+
+
+def main(argv=None):
+    from onnx_backend import FIXTURES
+
+    parser = argparse.ArgumentParser(description="Measure classification throughput for several worker counts")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--model', default='emotion')
+    parser.add_argument('--fixtures', default=FIXTURES)
+    parser.add_argument('--repeat', type=int, default=25)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    with open(args.fixtures, encoding='utf-8') as f:
+        texts = [line.strip() for line in f if line.strip()] * args.repeat
+    for row in scaling_report(texts, args.workers, args.model, args.batch_size):
+        print(f"{row['workers']} workers x {row['threads_per_worker']} threads: "
+              f"{row['reviews_per_sec']} reviews/sec ({row['speedup']}x)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
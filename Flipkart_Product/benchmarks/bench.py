@@ -0,0 +1,303 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = os.path.join(HERE, '..', 'fixtures')
+sys.path.insert(0, os.path.join(HERE, '..', 'app'))
+# The per-host limit protects Flipkart; the local stand-in server does not need it
+os.environ.setdefault('SCRAPE_RATE_PER_HOST', '1000')
+os.environ.setdefault('SCRAPE_BURST', '1000')
+# The pipeline benchmark measures fetching; replay is measured on its own
+os.environ.setdefault('PAGE_ARCHIVE', '0')
+
+from archive import PageArchive, reparse  # noqa: E402
+from dedup import deduplicate  # noqa: E402
+from emotions import EMOTION_LABELS  # noqa: E402
+from inference import classify_batched  # noqa: E402
+from ingest import iter_csv_column  # noqa: E402
+from review_parser import COLUMNS, parse_page  # noqa: E402
+from scores import ScoreMatrix  # noqa: E402
+from streaming import stream_analysis  # noqa: E402
+
+PAGE_FILES = ['reviews_page_1.html', 'reviews_page_2.html', 'reviews_page_3.html']
+EMPTY_PAGE = 'reviews_page_empty.html'
+
+
+def load_pages():
+    pages = []
+    for name in PAGE_FILES + [EMPTY_PAGE]:
+        with open(os.path.join(FIXTURES, 'pages', name), 'rb') as f:
+            pages.append(f.read())
+    return pages[:-1], pages[-1]
+
+
+def make_corpus(rows, seed=0):
+    # Deterministic synthetic reviews mixing the fixture sentences, short
+    # stock phrases and a long tail of longer comments
+    with open(os.path.join(FIXTURES, 'parity_reviews.txt'), encoding='utf-8') as f:
+        sentences = [line.strip() for line in f if line.strip()]
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(rows):
+        roll = rng.random()
+        if roll < 0.3:
+            text = rng.choice(sentences[:3])
+        elif roll < 0.95:
+            text = ' '.join(rng.sample(sentences, rng.randint(1, 3)))
+        else:
+            text = ' '.join(rng.choice(sentences) for _ in range(rng.randint(8, 20)))
+        corpus.append(text)
+    return corpus
+
+
+class SyntheticClassifier:
+    # Offline stand-in for the model: the work per call grows with the padded
+    # batch (batch size x longest input) like a real forward pass, and the
+    # labels are a deterministic function of the text
+    tokenizer = None
+
+    def __init__(self, hidden=64):
+        self.hidden = hidden
+        self.weights = np.random.default_rng(0).standard_normal((hidden, hidden)).astype(np.float32)
+
+    def __call__(self, texts, batch_size=None, truncation=True, top_k=None, **kwargs):
+        texts = [texts] if isinstance(texts, str) else list(texts)
+        padded = min(512, max(len(text) for text in texts) // 4 + 2)
+        activations = np.ones((len(texts), padded, self.hidden), dtype=np.float32)
+        np.tanh(activations @ self.weights)
+        outputs = []
+        for text in texts:
+            scores = np.random.default_rng(zlib.crc32(text.encode('utf-8'))).dirichlet(np.ones(len(EMOTION_LABELS)))
+            ranked = sorted(zip(EMOTION_LABELS, scores.tolist()), key=lambda item: -item[1])
+            outputs.append([{'label': label, 'score': score} for label, score in ranked])
+        return outputs
+
+
+def load_backend(name):
+    if name == 'synthetic':
+        return SyntheticClassifier()
+    os.environ.setdefault('HF_HUB_OFFLINE', '1')
+    if name == 'torch':
+        from transformers import pipeline
+        from models import EMOTION_MODEL
+        return pipeline('sentiment-analysis', model=os.environ.get('EMOTION_MODEL_PATH', EMOTION_MODEL))
+    if name == 'onnx':
+        from models import EMOTION_MODEL
+        from onnx_backend import load_onnx_classifier
+        return load_onnx_classifier(EMOTION_MODEL)
+    raise ValueError(f"unknown backend {name}")
+
+
+def timed(function, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def bench_parse(pages, empty_page, repeat):
+    reviews, seconds = timed(lambda: [parse_page(page) for page in pages], repeat)
+    _, empty_seconds = timed(lambda: parse_page(empty_page), repeat)
+    count = sum(len(page_reviews) for page_reviews in reviews)
+    return {
+        'pages_per_sec': round(len(pages) / seconds, 1),
+        'reviews_per_sec': round(count / seconds, 1),
+        'empty_pages_per_sec': round(1 / empty_seconds, 1)
+    }
+
+
+def bench_inference(corpus, backends, batch_sizes):
+    results = {}
+    for backend in backends:
+        try:
+            classifier = load_backend(backend)
+        except Exception as error:
+            results[backend] = {'skipped': f'{type(error).__name__}: {error}'}
+            continue
+        for batch_size in batch_sizes:
+            _, seconds = timed(lambda: classify_batched(classifier, corpus, batch_size, top_k=None))
+            results[f'{backend}_batch_{batch_size}'] = {'reviews_per_sec': round(len(corpus) / seconds, 1)}
+    return results
+
+
+def bench_csv(corpus):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'reviews.csv')
+        pd.DataFrame({
+            'Customer Name': ['Flipkart Customer'] * len(corpus),
+            'Review Title': ['Nice product'] * len(corpus),
+            'Rating': [5] * len(corpus),
+            'Comment': corpus
+        }, columns=COLUMNS).to_csv(path, index=False)
+        with open(path, 'rb') as f:
+            rows, seconds = timed(lambda: sum(len(chunk) for chunk in iter_csv_column(f)))
+    return {'rows_per_sec': round(rows / seconds, 1)}
+
+
+def bench_aggregate(corpus):
+    # What plot_emotions does with a run's predictions: pack the score
+    # vectors, then count categories from them
+    rng = np.random.default_rng(1)
+    predictions = []
+    for row in rng.dirichlet(np.ones(len(EMOTION_LABELS)), len(corpus)).tolist():
+        scores = dict(zip(EMOTION_LABELS, row))
+        label = max(scores, key=scores.get)
+        predictions.append({'label': label, 'score': scores[label], 'scores': scores})
+    _, seconds = timed(lambda: ScoreMatrix.from_predictions(predictions).category_counts())
+    return {'reviews_per_sec': round(len(predictions) / seconds, 1)}
+
+
+def bench_dedup(corpus):
+    results = {}
+    for name, near in (('exact', False), ('near', True)):
+        (_, _, stats), seconds = timed(lambda: deduplicate(corpus, near=near))
+        results[name] = {'texts_per_sec': round(len(corpus) / seconds, 1), 'dedup_ratio': stats['dedup_ratio']}
+    return results
+
+
+def bench_replay(pages, empty_page, count=600):
+    # Re-parse from a temporary archive; each body differs by a trailing
+    # comment so every page gets its own frame instead of being deduplicated
+    with tempfile.TemporaryDirectory() as directory:
+        archive = PageArchive(os.path.join(directory, 'archive'))
+        for i in range(count):
+            body = (pages + [empty_page])[i % (len(pages) + 1)] + f'<!-- {i} -->'.encode()
+            archive.put(f'http://fixtures/reviews?page={i}', body, product=f'product{i % 10}')
+        archive_stats = archive.stats()
+        stats = reparse(archive, csv_dir=directory)
+        archive.close()
+    return {
+        'pages_per_sec': stats['pages_per_sec'],
+        'raw_mb_per_sec': stats['raw_mb_per_sec'],
+        'compression_ratio': archive_stats['compression_ratio']
+    }
+
+
+def serve_fixtures(pages, empty_page):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            page = int(parse_qs(urlsplit(self.path).query).get('page', ['1'])[0])
+            body = pages[(page - 1) % len(pages)] if page <= 12 else empty_page
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    # A listen backlog of 5 drops some of the fetcher's parallel connects,
+    # which then stall for a full SYN retransmit
+    server = type('FixtureServer', (ThreadingHTTPServer,), {'request_queue_size': 64, 'daemon_threads': True})(
+        ('127.0.0.1', 0), Handler
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench_pipeline(pages, empty_page):
+    server = serve_fixtures(pages, empty_page)
+    url = f'http://127.0.0.1:{server.server_port}/reviews?page={{}}'
+    try:
+        start = time.perf_counter()
+        first = None
+        for update in stream_analysis((url.format(i) for i in range(1, 44)), SyntheticClassifier(), 'synthetic'):
+            if first is None and update['tally'].total:
+                first = time.perf_counter() - start
+        seconds = time.perf_counter() - start
+    finally:
+        server.shutdown()
+    return {
+        'reviews_per_sec': round(update['tally'].total / seconds, 1),
+        'first_insight_ms': round(first * 1000, 1) if first is not None else None
+    }
+
+
+def run(args):
+    pages, empty_page = load_pages()
+    results = {'parse': bench_parse(pages, empty_page, args.repeat), 'replay': bench_replay(pages, empty_page)}
+    for rows in args.sizes:
+        corpus = make_corpus(rows)
+        results[f'inference_{rows}'] = bench_inference(corpus, args.backends, args.batch_sizes)
+        results[f'csv_{rows}'] = bench_csv(corpus)
+        results[f'aggregate_{rows}'] = bench_aggregate(corpus)
+        results[f'dedup_{rows}'] = bench_dedup(corpus)
+    results['pipeline'] = bench_pipeline(pages, empty_page)
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'sizes': args.sizes,
+            'backends': args.backends
+        },
+        'results': results
+    }
+
+
+def flatten(results, prefix=''):
+    for key, value in results.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            yield from flatten(value, name + '.')
+        elif isinstance(value, (int, float)):
+            yield name, value
+
+
+def compare(current, baseline, tolerance):
+    # Throughput metrics (*_per_sec) regress when they drop, latency metrics
+    # (*_ms) when they rise, by more than the tolerance
+    baseline = dict(flatten(baseline['results']))
+    regressions = []
+    for name, value in flatten(current['results']):
+        before = baseline.get(name)
+        if not before:
+            continue
+        change = (value - before) / before
+        if (name.endswith('_per_sec') and change < -tolerance) or (name.endswith('_ms') and change > tolerance):
+            regressions.append({'metric': name, 'baseline': before, 'current': value, 'change': round(change, 3)})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline CPU benchmarks for parsing, inference, CSV ingestion, aggregation and the full pipeline")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--backends', nargs='+', default=['synthetic'], help="synthetic, torch and/or onnx")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32, 64])
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--output', default=os.path.join(HERE, 'results.json'))
+    parser.add_argument('--compare', help="baseline JSON to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.15)
+    args = parser.parse_args(argv)
+
+    current = run(args)
+    with open(args.output, 'w') as f:
+        json.dump(current, f, indent=2)
+    print(json.dumps(current['results'], indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(current, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression['metric']}: {regression['baseline']} -> {regression['current']} "
+                  f"({regression['change']:+.1%})")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())